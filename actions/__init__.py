@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
+import logging
 from typing import Dict, Text, Any, List, Union, Optional
 
 from rasa_sdk import Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.forms import FormAction
 
+from actions.cuisines import cuisine_catalog
+from actions.search import SearchUnavailable, restaurant_search
+
+logger = logging.getLogger(__name__)
+
 
 class RestaurantForm(FormAction):
     """Example of a custom form action"""
@@ -52,15 +58,7 @@ class RestaurantForm(FormAction):
     def cuisine_db() -> List[Text]:
         """Database of supported cuisines"""
 
-        return [
-            "caribbean",
-            "chinese",
-            "french",
-            "greek",
-            "indian",
-            "italian",
-            "mexican",
-        ]
+        return cuisine_catalog().values
 
     @staticmethod
     def is_int(string: Text) -> bool:
@@ -82,9 +80,11 @@ class RestaurantForm(FormAction):
     ) -> Optional[Text]:
         """Validate cuisine value."""
 
-        if value.lower() in self.cuisine_db():
-            # validation succeeded, set the value of the "cuisine" slot to value
-            return {"cuisine": value}
+        cuisine = cuisine_catalog().match(value)
+        if cuisine is not None:
+            # validation succeeded, set the value of the "cuisine" slot to
+            # the catalog value, i.e. "chinese" for "chinease"
+            return {"cuisine": cuisine}
         else:
             dispatcher.utter_template("utter_wrong_cuisine", tracker)
             # validation failed, set this slot to None, meaning the
@@ -143,4 +143,22 @@ class RestaurantForm(FormAction):
 
         # utter submit template
         dispatcher.utter_template("utter_submit", tracker)
+        try:
+            restaurants = restaurant_search().search(
+                tracker.get_slot("cuisine"),
+                tracker.get_slot("num_people"),
+                tracker.get_slot("outdoor_seating"),
+            )
+        except SearchUnavailable as e:
+            logger.warning(str(e))
+            return []
+
+        if restaurants:
+            dispatcher.utter_template(
+                "utter_restaurants",
+                tracker,
+                restaurants=", ".join(r["name"] for r in restaurants),
+            )
+        else:
+            dispatcher.utter_template("utter_no_restaurants", tracker)
         return []
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import os
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Text, Tuple
+
+CUISINE_FILE = os.path.join(os.path.dirname(__file__), "cuisines.txt")
+
+
+def read_catalog(file_name: Text) -> Iterable[Tuple[Text, List[Text]]]:
+    """Reads a catalog file with one value per line, optionally followed by
+    tab separated synonyms. Empty lines and lines starting with "#" are
+    skipped. This is the lookup file format of genEchoDefinition, so the
+    same file may fill the slot type of the Alexa skill."""
+
+    with open(file_name, "r", encoding="utf-8") as reader:
+        for line in reader:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            value, *synonyms = [part.strip() for part in line.split("\t")]
+            yield value, [synonym for synonym in synonyms if synonym]
+
+
+def normalize(text: Text) -> Text:
+    return " ".join(text.lower().split())
+
+
+def trigrams(text: Text) -> Set[Text]:
+    padded = "  {} ".format(text)
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
+def edit_distance(a: Text, b: Text, limit: int) -> int:
+    """Levenshtein distance of a and b, or limit + 1 if it exceeds limit."""
+
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class CuisineCatalog(object):
+    """Catalog of the supported cuisines.
+
+    Names and synonyms are looked up in a hashed exact match index first.
+    Misrecognized names ("chinease", "mexicans") are matched by their
+    trigrams against the names of the catalog, the candidates sharing the
+    most trigrams are accepted within a small edit distance. Results are
+    memoized."""
+
+    def __init__(
+        self,
+        entries: Iterable[Tuple[Text, List[Text]]],
+        candidates: int = 5,
+        cache_size: int = 4096,
+    ) -> None:
+        self.values = []  # type: List[Text]
+        self._names = {}  # type: Dict[Text, Text]
+        self._trigrams = defaultdict(list)  # type: Dict[Text, List[Text]]
+        self.candidates = candidates
+        for value, synonyms in entries:
+            self.add(value, synonyms)
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    @classmethod
+    def load(cls, file_name: Text = CUISINE_FILE) -> "CuisineCatalog":
+        return cls(read_catalog(file_name))
+
+    def add(self, value: Text, synonyms: Iterable[Text] = ()) -> None:
+        if hasattr(self, "match"):
+            self.match.cache_clear()
+        value = normalize(value)
+        if value not in self._names:
+            self.values.append(value)
+        for name in [value] + [normalize(synonym) for synonym in synonyms]:
+            if name in self._names:
+                continue
+            self._names[name] = value
+            for trigram in trigrams(name):
+                self._trigrams[trigram].append(name)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, name: Text) -> bool:
+        return normalize(name) in self._names
+
+    def _match(self, name: Text) -> Optional[Text]:
+        # Returns the catalog value of a name or None.
+        name = normalize(name)
+        value = self._names.get(name)
+        if value is not None or not name:
+            return value
+
+        shared = defaultdict(int)  # type: Dict[Text, int]
+        for trigram in trigrams(name):
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        ranked = sorted(shared.items(), key=lambda item: -item[1])
+        limit = max(1, len(name) // 4)
+        best, best_distance = None, limit + 1
+        for candidate, _ in ranked[: self.candidates]:
+            distance = edit_distance(name, candidate, limit)
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        return self._names[best] if best is not None else None
+
+
+_catalog = None  # type: Optional[CuisineCatalog]
+
+
+def cuisine_catalog() -> CuisineCatalog:
+    """The catalog of CUISINE_FILE, loaded on first use."""
+
+    global _catalog
+    if _catalog is None:
+        _catalog = CuisineCatalog.load()
+    return _catalog
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Restaurant search of the RestaurantForm on a local SQLite database.
+
+The action server of rasa_sdk serves its requests in gevent greenlets, a
+blocking query would stall all of them. Queries therefore run on worker
+threads (the gevent threadpool if gevent is available) with a pool of
+connections, and the caller waits for at most the configured timeout.
+Results are cached, a query running out of time still fills the cache
+for the next turn.
+
+Generate a database with
+python -m actions.search -d actions/restaurants.db -n 100000
+"""
+
+import argparse
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+try:
+    import gevent
+except ImportError:  # pragma: no cover
+    gevent = None
+
+RESTAURANT_DB = os.path.join(os.path.dirname(__file__), "restaurants.db")
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 300.0
+# stay well within the Alexa deadline of the whole turn
+DEFAULT_TIMEOUT = 2.0
+DEFAULT_LIMIT = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS restaurants (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    cuisine TEXT NOT NULL,
+    capacity INTEGER NOT NULL,
+    outdoor INTEGER NOT NULL,
+    rating REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS restaurants_seating
+    ON restaurants (cuisine, outdoor, rating DESC, capacity);
+CREATE INDEX IF NOT EXISTS restaurants_cuisine
+    ON restaurants (cuisine, rating DESC, capacity);
+"""
+# The indexes are in rating order, so a search stops after the first rows
+# with enough capacity instead of sorting all restaurants of a cuisine.
+
+QUERY = (
+    "SELECT name, cuisine, capacity, outdoor, rating FROM restaurants "
+    "WHERE cuisine = ? AND capacity >= ? {} "
+    "ORDER BY rating DESC LIMIT ?"
+)
+
+SearchKey = Tuple[Text, int, Optional[bool]]
+
+
+class SearchUnavailable(Exception):
+    """The search failed or did not answer in time."""
+
+
+class ConnectionPool(object):
+    """A fixed number of connections to the database, shared by the worker
+    threads."""
+
+    def __init__(self, database: Text, size: int = DEFAULT_POOL_SIZE) -> None:
+        if not os.path.exists(database):
+            raise SearchUnavailable("No restaurant database {}".format(database))
+        self._connections = queue.Queue()  # type: queue.Queue
+        for _ in range(size):
+            connection = sqlite3.connect(database, check_same_thread=False)
+            connection.execute("PRAGMA query_only = ON")
+            self._connections.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self._connections.get()
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+
+class QueryCache(object):
+    """LRU cache of search results, expiring after ttl seconds."""
+
+    def __init__(
+        self, max_entries: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_CACHE_TTL
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def get(self, key: SearchKey, now: Optional[float] = None) -> Optional[List]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: SearchKey, value: List, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def search_key(cuisine: Text, num_people: Any, outdoor_seating: Any) -> SearchKey:
+    try:
+        people = max(1, int(num_people))
+    except (TypeError, ValueError):
+        people = 1
+    outdoor = outdoor_seating if isinstance(outdoor_seating, bool) else None
+    return cuisine.lower(), people, outdoor
+
+
+class RestaurantSearch(object):
+    def __init__(
+        self,
+        database: Text = RESTAURANT_DB,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        cache_ttl: float = DEFAULT_CACHE_TTL,
+        timeout: float = DEFAULT_TIMEOUT,
+        limit: int = DEFAULT_LIMIT,
+    ) -> None:
+        self.pool = ConnectionPool(database, pool_size)
+        self.cache = QueryCache(cache_size, cache_ttl)
+        self.timeout = timeout
+        self.limit = limit
+        if gevent is None:
+            self._executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    def query(self, key: SearchKey) -> List[Dict[Text, Any]]:
+        # Runs on a worker thread.
+        cuisine, people, outdoor = key
+        params = [cuisine, people]  # type: List[Any]
+        condition = ""
+        if outdoor is not None:
+            condition = "AND outdoor = ?"
+            params.append(int(outdoor))
+        params.append(self.limit)
+        with self.pool.connection() as connection:
+            rows = connection.execute(QUERY.format(condition), params).fetchall()
+        result = [
+            {
+                "name": name,
+                "cuisine": cuisine,
+                "capacity": capacity,
+                "outdoor": bool(outdoor),
+                "rating": rating,
+            }
+            for name, cuisine, capacity, outdoor, rating in rows
+        ]
+        self.cache.put(key, result)
+        return result
+
+    def search(
+        self, cuisine: Text, num_people: Any, outdoor_seating: Any = None
+    ) -> List[Dict[Text, Any]]:
+        """Returns the best rated restaurants of a cuisine with room for
+        num_people, inside or outside if outdoor_seating is a bool.
+        Raises SearchUnavailable if there is no answer within timeout."""
+
+        key = search_key(cuisine, num_people, outdoor_seating)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        try:
+            if gevent is not None:
+                # yields to the other greenlets while waiting
+                return (
+                    gevent.get_hub()
+                    .threadpool.spawn(self.query, key)
+                    .get(timeout=self.timeout)
+                )
+            return self._executor.submit(self.query, key).result(self.timeout)
+        except (FutureTimeout, getattr(gevent, "Timeout", FutureTimeout)):
+            raise SearchUnavailable(
+                "Restaurant search timed out after {} s".format(self.timeout)
+            )
+        except sqlite3.Error as e:
+            raise SearchUnavailable("Restaurant search failed: {}".format(e))
+
+
+_search = None  # type: Optional[RestaurantSearch]
+
+
+def restaurant_search() -> RestaurantSearch:
+    """The search of RESTAURANT_DB, created on first use."""
+
+    global _search
+    if _search is None:
+        _search = RestaurantSearch()
+    return _search
+
+
+def generate_restaurants(
+    database: Text, count: int, cuisines: List[Text], seed: int = 42
+) -> None:
+    """Creates a database with count random restaurants of the cuisines."""
+
+    rnd = random.Random(seed)
+    words = ["golden", "little", "old", "royal", "blue", "green", "corner",
+             "garden", "river", "market", "house", "kitchen", "table", "inn"]
+    connection = sqlite3.connect(database)
+    try:
+        connection.executescript(SCHEMA)
+        rows = (
+            (
+                "{} {} {}".format(
+                    rnd.choice(words).title(), rnd.choice(words).title(), idx
+                ),
+                rnd.choice(cuisines),
+                rnd.choice((2, 4, 6, 8, 10, 12, 20, 40)),
+                int(rnd.random() < 0.4),
+                round(rnd.uniform(1.0, 5.0), 1),
+            )
+            for idx in range(count)
+        )
+        connection.executemany(
+            "INSERT INTO restaurants (name, cuisine, capacity, outdoor, rating) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        connection.commit()
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    from actions.cuisines import cuisine_catalog
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d", "--database", help="database file", default=RESTAURANT_DB
+    )
+    parser.add_argument(
+        "-n", "--number", help="restaurants", type=int, default=10000
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate_restaurants(
+        args.database, args.number, cuisine_catalog().values, args.seed
+    )
+    print("{} restaurants written to {}".format(args.number, args.database))
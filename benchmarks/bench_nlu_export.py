@@ -0,0 +1,129 @@
+# Benchmark of the nlu.md import of EchoModel.export2echo against the
+# former two pass implementation.
+#
+# run with
+# python -m benchmarks.bench_nlu_export
+
+import argparse
+import os
+import re
+import tempfile
+import time
+from benchmarks.nlu_corpus import write_nlu_file
+from echo2rasa.tools.echomodel import EchoModel
+
+DOMAIN = os.path.join("tests", "resources", "domain.yml")
+ECHO_DOMAIN = os.path.join("tests", "resources", "echo_domain.yml")
+
+re_entities_and_values = re.compile(r"(\[[^\[]*\][^\[]*\([^\[\(]*\))")
+re_value = re.compile(r"(\[.*\])")
+re_entity = re.compile(r"(\(.*\))")
+
+
+class LegacyEchoModel(EchoModel):
+    # The nlu.md import before the single pass parser.
+
+    def _import_nlu_file(self):
+        def parse_utterance(utterance):
+            def format_entities(matchobj):
+                entity_without_paranthesis = matchobj.group(0)[1:-1]
+                idxOfCol = entity_without_paranthesis.find(':')
+                if (idxOfCol >= 0):
+                    entity_without_paranthesis = \
+                        entity_without_paranthesis[0:idxOfCol]
+                return "{"+entity_without_paranthesis+"}"
+
+            utterance = re.sub(r"(\?)", '', utterance)
+            utterance = re.sub(r"(!)", '', utterance)
+            utterance = re.sub(r"(,)", '', utterance)
+            utterance = re.sub(r"(\d)", '', utterance)
+            result = re.sub(r"(\(.*?\))", format_entities, utterance)
+            result = re.sub(r"(\[.*?\])", '', result)
+            slots = re.findall(r"(\{.*?\})", result)
+            return slots, result
+
+        with open(self._rasa_nlu_file, 'r') as reader:
+            line = reader.readline().strip()
+            while line != '':
+                if line.startswith('## intent:'):
+                    intentName = line[10:]
+                    intentSlots = []
+                    line = reader.readline().strip()
+                    while line.startswith('-'):
+                        utterance = line[1:].strip()
+                        slots, utterance = parse_utterance(utterance)
+                        self._intent_dir[intentName]['samples'].append(
+                            utterance)
+                        if (len(slots) > 0):
+                            intentSlots.extend(slots)
+                        line = reader.readline().strip()
+                    if (len(intentSlots) > 0):
+                        self._intent_dir[intentName]['slots'] = intentSlots
+                line = reader.readline().strip()
+
+    def _import_entity_definitions(self):
+        def update_entity(name, value, alias):
+            entityName = self._slots_dir[name]["type"]
+            entityEntry = self._entitiy_types.get(
+                entityName, {value: []})
+            entityValues = entityEntry.get(value, [])
+            if (alias is not None):
+                entityValues.append(alias)
+            entityEntry[value] = list(set(entityValues))
+            self._entitiy_types[entityName] = entityEntry
+
+        entityAndValueList = []
+        with open(self._rasa_nlu_file, 'r') as reader:
+            for line in reader:
+                entityAndValueList.extend(re_entities_and_values.findall(line))
+
+        for entityAndValue in entityAndValueList:
+            hasAlias = False
+            entityGroup = re_entity.search(entityAndValue)
+            if (entityGroup is not None):
+                entityName = entityGroup[0][1: -1]
+                if (entityName.find(":") > 0):
+                    entityName, entityValue = entityName.split(":")
+                    hasAlias = True
+                valueGroup = re_value.search(entityAndValue)
+                if (valueGroup is not None):
+                    alias = valueGroup[0][1: -1]
+                    if (hasAlias):
+                        update_entity(entityName, entityValue, alias)
+                    else:
+                        update_entity(entityName, alias, None)
+
+        # the json representation of the types is left out on purpose, it
+        # does not differ between both implementations
+
+
+def run(modelClass, nluFile):
+    model = modelClass("bench", DOMAIN, nluFile, ECHO_DOMAIN)
+    start = time.perf_counter()
+    model._import_domain()
+    model._import_nlu_file()
+    model._add_echo_conf()
+    model._update_intent_slotlist()
+    model._import_entity_definitions()
+    return time.perf_counter() - start
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-u", "--utterances", help="utterances per nlu file",
+                        type=int, nargs="+",
+                        default=[10000, 100000, 1000000])
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = readArgs()
+    with tempfile.TemporaryDirectory() as tmp:
+        for utterances in args.utterances:
+            nluFile = os.path.join(tmp, "nlu_{}.md".format(utterances))
+            write_nlu_file(nluFile, utterances)
+            for name, modelClass in (("legacy", LegacyEchoModel),
+                                     ("single pass", EchoModel)):
+                seconds = run(modelClass, nluFile)
+                print(f'{name:12} {utterances:8} utterances: '
+                      f'{seconds:8.3f} s')
@@ -0,0 +1,61 @@
+# Microbenchmark of the Alexa webhook body decoding.
+#
+# run with
+# python -m benchmarks.bench_request_decoding
+
+import argparse
+import io
+import json
+import timeit
+from echo2rasa.echoconnector import decode_alexa_request
+
+TEMPLATE = "tests/resources/echorequest.json"
+
+
+def make_payload(template, size):
+    # Pads the apiAccessToken of the template request until the encoded
+    # body has about the given size in bytes.
+    with open(template, 'r') as f:
+        envelope = json.load(f)
+    system = envelope["context"]["System"]
+    missing = size - len(json.dumps(envelope).encode("utf-8"))
+    if missing > 0:
+        system["apiAccessToken"] += "x" * missing
+    return json.dumps(envelope).encode("utf-8")
+
+
+def legacy_decode(body):
+    # The decoding done by EchoConnector.receive before the decoder layer:
+    # the sanic request.json parse and the print of the whole body.
+    envelope = json.loads(body)
+    print(envelope, file=io.StringIO())
+    sender_id = envelope.get("session")["user"]["userId"]
+    return sender_id, envelope.get("request")
+
+
+def decoder_decode(body):
+    req = decode_alexa_request(body)
+    return req.sender_id, req.request
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--template", help="Alexa request template",
+                        default=TEMPLATE)
+    parser.add_argument("-s", "--sizes", help="payload sizes in bytes",
+                        type=int, nargs="+", default=[5 * 1024, 10 * 1024])
+    parser.add_argument("-n", "--number", help="decodes per measurement",
+                        type=int, default=10000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = readArgs()
+    for size in args.sizes:
+        body = make_payload(args.template, size)
+        for name, decode in (("legacy", legacy_decode),
+                             ("decoder", decoder_decode)):
+            best = min(timeit.repeat(lambda: decode(body),
+                                     number=args.number, repeat=5))
+            print(f'{name:8} {len(body):6} bytes: '
+                  f'{best / args.number * 1e6:8.2f} us/request')
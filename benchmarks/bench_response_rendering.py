@@ -0,0 +1,67 @@
+# Microbenchmark of the Alexa response rendering.
+#
+# run with
+# python -m benchmarks.bench_response_rendering
+
+import argparse
+import json
+import timeit
+from echo2rasa.echoconnector import AlexaResponseRenderer
+
+DOMAIN = "domain.yml"
+
+
+def getJsonObject(obj):
+    # The str()/replace()/json.loads round trip formerly done by mapp2Echo.
+    jString = str(obj).replace("{'", '{"').replace("':", '":')\
+        .replace(", '", ', "')\
+        .replace(": '", ': "').replace("', ", '", ').replace("'}", '"}')
+    return json.loads(jString)
+
+
+def legacy_render(messages):
+    # mapp2Echo before the renderer, including the response.json encoding.
+    answer = getJsonObject(messages[0]).get("text")
+    return json.dumps({
+        "version": "0.1",
+        "sessionAttributes": {
+            "status": "test"
+        },
+        "response": {
+            "outputSpeech": {
+                "type": "PlainText",
+                "text": answer,
+                "playBehavior": "REPLACE_ENQUEUED"
+            },
+            "reprompt": {
+                "outputSpeech": {
+                    "type": "PlainText",
+                    "text": answer,
+                    "playBehavior": "REPLACE_ENQUEUED"
+                }
+            },
+            "shouldEndSession": "false"
+        }
+    }).encode("utf-8")
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--domain", help="domain definition file",
+                        default=DOMAIN)
+    parser.add_argument("-n", "--number", help="renders per measurement",
+                        type=int, default=20000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = readArgs()
+    renderer = AlexaResponseRenderer()
+    renderer.compile_templates(args.domain)
+    messages = [{"recipient_id": "amzn1.ask.account.test",
+                 "text": "do you want to seat outside?"}]
+    for name, render in (("legacy", legacy_render),
+                         ("renderer", renderer.render)):
+        best = min(timeit.repeat(lambda: render(messages),
+                                 number=args.number, repeat=5))
+        print(f'{name:8}: {best / args.number * 1e6:8.2f} us/response')
@@ -0,0 +1,62 @@
+# Benchmark of the restaurant search of the RestaurantForm on generated
+# databases of increasing size.
+#
+# run with
+# python -m benchmarks.bench_restaurant_search
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from actions.cuisines import cuisine_catalog
+from actions.search import RestaurantSearch, generate_restaurants, \
+    search_key
+from benchmarks.suite import percentiles
+
+
+def run(database, queries, seed):
+    cuisines = cuisine_catalog().values
+    rnd = random.Random(seed)
+    keys = [search_key(rnd.choice(cuisines), rnd.randint(1, 12),
+                       rnd.choice((True, False, None)))
+            for _ in range(queries)]
+    search = RestaurantSearch(database)
+    # uncached queries on the worker thread
+    latencies = []
+    for key in keys:
+        start = time.perf_counter()
+        search.query(key)
+        latencies.append(time.perf_counter() - start)
+    # searches answered by the query cache
+    start = time.perf_counter()
+    for key in keys:
+        search.search(*key)
+    cached = (time.perf_counter() - start) / len(keys)
+    return percentiles(latencies), cached
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--restaurants", help="restaurants per database",
+                        type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("-q", "--queries", help="queries per database",
+                        type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = readArgs()
+    with tempfile.TemporaryDirectory() as tmp:
+        for restaurants in args.restaurants:
+            database = os.path.join(tmp, f'restaurants_{restaurants}.db')
+            start = time.perf_counter()
+            generate_restaurants(database, restaurants,
+                                 cuisine_catalog().values, args.seed)
+            generated = time.perf_counter() - start
+            query, cached = run(database, args.queries, args.seed)
+            print(f'{restaurants:8} restaurants ({generated:6.2f} s to '
+                  f'generate): query p50 {query["p50"] * 1e6:8.1f} us, '
+                  f'p99 {query["p99"] * 1e6:8.1f} us, '
+                  f'cached {cached * 1e6:6.1f} us')
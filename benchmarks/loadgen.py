@@ -0,0 +1,212 @@
+# Load generator replaying Alexa traffic against a running echo connector.
+#
+# Virtual users follow the conversations of data/stories.md, every story
+# step is sent as IntentRequest of the story intent, framed by a
+# LaunchRequest and a SessionEndedRequest. The request rate over all users
+# is limited, the number of users sets the concurrency.
+#
+# run with
+# python -m benchmarks.loadgen -r 20 -c 10 -d 60
+# python -m benchmarks.loadgen -u https://64332fd1.ngrok.io/webhooks/echo/webhook
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import aiohttp
+from benchmarks.nlu_corpus import AlexaRequestFactory, INTENT_SLOTS, \
+    REQUEST_TEMPLATE, now_timestamp, random_slot
+from benchmarks.suite import percentiles
+
+URL = "http://localhost:5005/webhooks/echo/webhook"
+STORIES = "data/stories.md"
+ALEXA_DEADLINE = 8.0
+
+
+def read_stories(fileName):
+    # Returns the stories as lists of (intent, entities) user turns, i.e.
+    # "* form: inform{"cuisine": "mexican"}" -> ("inform", {"cuisine": ...}).
+    stories = []
+    story = None
+    with open(fileName, 'r') as reader:
+        for line in reader:
+            line = line.strip()
+            if line.startswith('## '):
+                story = []
+                stories.append(story)
+            elif line.startswith('* ') and story is not None:
+                event = line[2:].strip()
+                if event.startswith('form:'):
+                    event = event[5:].strip()
+                intent, brace, entities = event.partition('{')
+                story.append((intent.strip(),
+                              json.loads(brace + entities) if brace else {}))
+    return [story for story in stories if story]
+
+
+class Pacer(object):
+    """Spaces the requests of all users evenly at the given rate."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next = time.monotonic()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(self.next, now)
+        self.next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class LoadReport(object):
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.deadline_misses = 0
+        self.conversations = 0
+        self.started = time.monotonic()
+        self.stopped = None
+
+    def record(self, latency, status=None):
+        self.latencies.append(latency)
+        if status is None:
+            self.errors += 1
+        else:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status != 200:
+                self.errors += 1
+        if latency > self.deadline:
+            self.deadline_misses += 1
+
+    def as_dict(self):
+        seconds = (self.stopped or time.monotonic()) - self.started
+        requests = len(self.latencies)
+        result = {
+            "seconds": seconds,
+            "conversations": self.conversations,
+            "requests": requests,
+            "throughput": requests / seconds if seconds else 0.0,
+            "error_rate": self.errors / requests if requests else 0.0,
+            "deadline_misses": self.deadline_misses,
+            "statuses": {str(status): count
+                         for status, count in self.statuses.items()}}
+        result.update(percentiles(self.latencies))
+        return result
+
+
+class VirtualUser(object):
+
+    def __init__(self, factory, stories, rnd):
+        self.factory = factory
+        self.stories = stories
+        self.rnd = rnd
+
+    def conversation(self):
+        # Returns the request envelopes of a random story of a new user.
+        user_id = "amzn1.ask.account.load" + str(self.rnd.getrandbits(64))
+        yield self.factory.envelope(user_id, "LaunchRequest",
+                                    new_session=True)
+        for intent, entities in self.rnd.choice(self.stories):
+            slots = {entity: random_slot(entity, self.rnd)
+                     for entity in INTENT_SLOTS.get(intent, [])}
+            for entity, value in entities.items():
+                slots[entity] = {"name": entity, "value": value,
+                                 "confirmationStatus": "NONE"}
+            yield self.factory.envelope(user_id, intent=intent, slots=slots)
+        yield self.factory.envelope(user_id, "SessionEndedRequest")
+
+
+async def post(session, url, envelope, report, timeout):
+    envelope["request"]["timestamp"] = now_timestamp()
+    body = json.dumps(envelope)
+    start = time.monotonic()
+    try:
+        async with session.post(
+                url, data=body, timeout=timeout,
+                headers={"Content-Type": "application/json"}) as resp:
+            await resp.read()
+            report.record(time.monotonic() - start, resp.status)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        report.record(time.monotonic() - start)
+
+
+async def run_user(user, session, args, pacer, report, stop_at):
+    while time.monotonic() < stop_at:
+        for envelope in user.conversation():
+            if time.monotonic() >= stop_at:
+                return
+            await pacer.wait()
+            await post(session, args.url, envelope, report, args.timeout)
+            if args.think:
+                await asyncio.sleep(user.rnd.uniform(0, 2 * args.think))
+        report.conversations += 1
+
+
+async def run_load(args):
+    stories = read_stories(args.stories)
+    rnd = random.Random(args.seed)
+    factory = AlexaRequestFactory(args.template, args.seed)
+    pacer = Pacer(args.rate)
+    report = LoadReport(args.deadline)
+    stop_at = time.monotonic() + args.duration
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*[
+            run_user(VirtualUser(factory, stories,
+                                 random.Random(rnd.getrandbits(64))),
+                     session, args, pacer, report, stop_at)
+            for _ in range(args.concurrency)])
+    report.stopped = time.monotonic()
+    return report
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-u", "--url", help="webhook of the echo connector",
+                        default=URL)
+    parser.add_argument("-r", "--rate", help="requests per second, 0 for "
+                        "as fast as possible", type=float, default=10.0)
+    parser.add_argument("-c", "--concurrency", help="concurrent users",
+                        type=int, default=10)
+    parser.add_argument("-d", "--duration", help="seconds of load",
+                        type=float, default=30.0)
+    parser.add_argument("--think", help="mean seconds between the turns of "
+                        "a user", type=float, default=0.0)
+    parser.add_argument("-s", "--stories", help="stories to follow",
+                        default=STORIES)
+    parser.add_argument("-t", "--template", help="Alexa request template",
+                        default=REQUEST_TEMPLATE)
+    parser.add_argument("--deadline", help="seconds Alexa waits for an "
+                        "answer", type=float, default=ALEXA_DEADLINE)
+    parser.add_argument("--timeout", help="seconds until a request is "
+                        "given up", type=float, default=30.0)
+    parser.add_argument("-o", "--output", help="json file of the report")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = readArgs()
+    report = asyncio.get_event_loop().run_until_complete(run_load(args))
+    result = report.as_dict()
+    print(f'{result["requests"]} requests of {result["conversations"]} '
+          f'conversations in {result["seconds"]:.1f} s: '
+          f'{result["throughput"]:.1f} requests/s')
+    if result["requests"]:
+        print(f'latency p50 {result["p50"] * 1000:.1f} ms, '
+              f'p95 {result["p95"] * 1000:.1f} ms, '
+              f'p99 {result["p99"] * 1000:.1f} ms')
+    print(f'error rate {result["error_rate"]:.2%}, '
+          f'{result["deadline_misses"]} deadline misses '
+          f'(> {args.deadline:.1f} s), statuses {result["statuses"]}')
+    if args.output is not None:
+        with open(args.output, 'w') as writer:
+            json.dump(result, writer, indent=2)
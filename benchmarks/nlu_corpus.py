@@ -0,0 +1,146 @@
+# Generators of synthetic training data and Alexa requests for the
+# benchmarks, based on the restaurant example of this project.
+
+import copy
+import json
+import random
+import uuid
+from datetime import datetime, timezone
+
+INTENTS = ["greet", "request_restaurant", "inform", "affirm", "deny",
+           "stop", "thankyou", "chitchat"]
+
+ENTITY_VALUES = {
+    "cuisine": ["chinese", "italian", "mexican", "greek", "indian",
+                "french", "caribbean", "asian", "gastropub"],
+    "seating": ["outside", "inside", "outdoor", "indoor"],
+    "feedback": ["good", "great", "terrible", "bad"],
+}
+
+ALIASES = {
+    ("cuisine", "asian"): ["pan asian", "asian oriental"],
+    ("cuisine", "gastropub"): ["gastro pub"],
+}
+
+# slots the Alexa skill fills for an intent
+INTENT_SLOTS = {
+    "request_restaurant": ["cuisine", "num_people"],
+    "inform": ["cuisine", "num_people", "seating", "feedback"],
+}
+
+REQUEST_TEMPLATE = "tests/resources/echorequest.json"
+
+TEMPLATES = [
+    "i am looking for a {cuisine} restaurant",
+    "a table for {num_people} people please",
+    "can we sit {seating}",
+    "i want {cuisine} food for {num_people} {seating}",
+    "the food was {feedback}",
+    "any {cuisine} place will do",
+]
+
+
+def annotate(entity, rnd):
+    # Returns the markdown annotation of a random value of an entity.
+    if entity == "num_people":
+        number = rnd.randint(1, 12)
+        return "[{}](num_people:{})".format(number, number)
+    value = rnd.choice(ENTITY_VALUES[entity])
+    aliases = ALIASES.get((entity, value))
+    if aliases and rnd.random() < 0.5:
+        return "[{}]({}:{})".format(rnd.choice(aliases), entity, value)
+    return "[{}]({})".format(value, entity)
+
+
+def write_nlu_file(path, utterances, seed=42):
+    """Writes a nlu.md file with the given number of annotated utterances,
+    spread evenly over the intents of the example domain."""
+
+    rnd = random.Random(seed)
+    perIntent = max(1, utterances // len(INTENTS))
+    with open(path, 'w') as writer:
+        for intent in INTENTS:
+            writer.write("## intent:{}\n".format(intent))
+            for idx in range(perIntent):
+                template = rnd.choice(TEMPLATES)
+                utterance = template.format(**{
+                    entity: annotate(entity, rnd)
+                    for entity in ("cuisine", "num_people", "seating",
+                                   "feedback")})
+                writer.write("- {} {}\n".format(utterance, idx))
+            writer.write("\n")
+
+
+def random_user_id(rnd):
+    return "amzn1.ask.account." + "".join(
+        rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ234567") for _ in range(64))
+
+
+def random_slot(entity, rnd):
+    # Returns an Alexa slot with a random value of an entity. Aliases are
+    # sent along with an entity resolution like the Alexa service does.
+    slot = {"name": entity, "confirmationStatus": "NONE"}
+    if entity == "num_people":
+        slot["value"] = str(rnd.randint(1, 12))
+        return slot
+    if rnd.random() < 0.2:
+        return slot    # unfilled
+    value = rnd.choice(ENTITY_VALUES[entity])
+    aliases = ALIASES.get((entity, value))
+    if aliases and rnd.random() < 0.5:
+        slot["value"] = rnd.choice(aliases)
+        slot["resolutions"] = {"resolutionsPerAuthority": [{
+            "authority": "amzn1.er-authority.echo-sdk.test." + entity,
+            "status": {"code": "ER_SUCCESS_MATCH"},
+            "values": [{"value": {"name": value, "id": value}}]}]}
+    else:
+        slot["value"] = value
+    return slot
+
+
+def now_timestamp():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class AlexaRequestFactory(object):
+    """Builds Alexa request envelopes from a template request, with fresh
+    request ids and the given or random users, intents and slots. Requests
+    are sent now unless a timestamp is given, a past one would leave no
+    time for their turns."""
+
+    def __init__(self, template=REQUEST_TEMPLATE, seed=42):
+        with open(template, 'r') as f:
+            self.template = json.load(f)
+        self.rnd = random.Random(seed)
+
+    def envelope(self, user_id=None, request_type="IntentRequest",
+                 intent=None, slots=None, new_session=False,
+                 timestamp=None):
+        envelope = copy.deepcopy(self.template)
+        user_id = user_id or random_user_id(self.rnd)
+        envelope["session"]["user"]["userId"] = user_id
+        envelope["session"]["new"] = new_session
+        envelope["context"]["System"]["user"]["userId"] = user_id
+        request = {
+            "type": request_type,
+            "requestId": "amzn1.echo-api.request." + str(
+                uuid.UUID(int=self.rnd.getrandbits(128))),
+            "timestamp": timestamp or now_timestamp(),
+            "locale": "en-GB"
+        }
+        if request_type == "IntentRequest":
+            intent = intent or self.rnd.choice(INTENTS)
+            if slots is None:
+                slots = {entity: random_slot(entity, self.rnd)
+                         for entity in INTENT_SLOTS.get(intent, [])}
+            request["intent"] = {"name": intent,
+                                 "confirmationStatus": "NONE"}
+            if slots:
+                request["intent"]["slots"] = slots
+        elif request_type == "SessionEndedRequest":
+            request["reason"] = "USER_INITIATED"
+        envelope["request"] = request
+        return envelope
+
+    def body(self, **kwargs):
+        return json.dumps(self.envelope(**kwargs)).encode("utf-8")
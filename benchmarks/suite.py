@@ -0,0 +1,199 @@
+# Benchmark suite of the connector, the NLU mapper and the model export.
+# The results are saved as json, a run compared with the results of a
+# former release reports the benchmarks that got slower.
+#
+# run with
+# python -m benchmarks.suite -o bench_results.json
+# python -m benchmarks.suite -o new.json --baseline bench_results.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.nlu_corpus import AlexaRequestFactory, write_nlu_file
+
+DOMAIN = os.path.join("tests", "resources", "domain.yml")
+ECHO_DOMAIN = os.path.join("tests", "resources", "echo_domain.yml")
+SKILL_MODEL = os.path.join("echo2rasa", "tools", "echoSkillConfiguration.json")
+
+
+def percentiles(values, points=(50, 95, 99)):
+    # Nearest rank percentiles of a list of measurements.
+    ordered = sorted(values)
+    if not ordered:
+        return {f'p{point}': None for point in points}
+    return {f'p{point}': ordered[min(len(ordered) - 1,
+                                     int(len(ordered) * point / 100))]
+            for point in points}
+
+
+def bench_mapper(requests):
+    # EchoNLUMapper.process on registered Alexa requests.
+    from rasa.nlu.training_data import Message
+    from echo2rasa.echoconnector import EchoNLUMapper, \
+        register_echo_request, release_echo_request
+
+    mapper = EchoNLUMapper(index=EchoNLUMapper.build_index(SKILL_MODEL))
+    keys = [register_echo_request(envelope["request"])
+            for envelope in requests]
+    try:
+        start = time.perf_counter()
+        for key in keys:
+            mapper.process(Message(key))
+        seconds = time.perf_counter() - start
+    finally:
+        for key in keys:
+            release_echo_request(key)
+    return {"unit": "requests/s", "higher_is_better": True,
+            "value": len(keys) / seconds, "requests": len(keys)}
+
+
+class StubRequest(object):
+    # The parts of a sanic request used by the webhook route.
+
+    def __init__(self, body):
+        self.body = body
+        self.args = {}
+        self.app = None
+
+
+def bench_webhook(bodies):
+    # receive -> mapp2Echo of the webhook route in-process, with a stub
+    # on_new_message that maps the request and utters a text.
+    from echo2rasa.echoconnector import EchoConnector, EchoInterpreter, \
+        metrics
+
+    interpreter = EchoInterpreter()
+
+    async def on_new_message(message):
+        result = await interpreter.parse(message.text, message.message_id)
+        await message.output_channel.send_text_message(
+            message.sender_id,
+            "you asked for {}".format(result["intent"]["name"]))
+
+    connector = EchoConnector(domain_file="domain.yml")
+    blueprint = connector.blueprint(on_new_message)
+    receive = next(route.handler for route in blueprint.routes
+                   if route.uri == "/webhook")
+
+    async def run():
+        latencies = []
+        for body in bodies:
+            start = time.perf_counter()
+            result = await receive(StubRequest(body))
+            latencies.append(time.perf_counter() - start)
+            if result.status != 200:
+                raise RuntimeError(f'webhook answered {result.status}')
+        return latencies
+
+    metrics.reset()
+    latencies = asyncio.get_event_loop().run_until_complete(run())
+    result = {"unit": "s", "higher_is_better": False,
+              "value": percentiles(latencies)["p50"],
+              "requests": len(latencies),
+              "stages": {stage: histogram["sum"] / max(histogram["count"], 1)
+                         for stage, histogram in
+                         metrics.as_dict()["histograms"].items()}}
+    result.update(percentiles(latencies))
+    return result
+
+
+def bench_export(utterances):
+    # EchoModel.export2echo of a generated nlu file.
+    from echo2rasa.tools.echomodel import EchoModel
+
+    with tempfile.TemporaryDirectory() as tmp:
+        nluFile = os.path.join(tmp, "nlu.md")
+        write_nlu_file(nluFile, utterances)
+        model = EchoModel("bench", DOMAIN, nluFile, ECHO_DOMAIN)
+        start = time.perf_counter()
+        model.export2echo(os.path.join(tmp, "model.json"))
+        seconds = time.perf_counter() - start
+    return {"unit": "s", "higher_is_better": False, "value": seconds,
+            "utterances": utterances}
+
+
+def run_suite(args):
+    factory = AlexaRequestFactory(seed=args.seed)
+    results = {}
+    requests = [factory.envelope(intent=factory.rnd.choice(
+        ["request_restaurant", "inform"])) for _ in range(args.requests)]
+    results["mapper_process"] = bench_mapper(requests)
+    bodies = [factory.body() for _ in range(args.requests)]
+    results["webhook_latency"] = bench_webhook(bodies)
+    for utterances in args.utterances:
+        results[f'export2echo_{utterances}'] = bench_export(utterances)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    # Returns the benchmarks that are more than tolerance worse than the
+    # baseline, as name -> (baseline value, value).
+    regressions = {}
+    for name, result in results.items():
+        former = baseline.get(name)
+        if former is None or not former["value"] or not result["value"]:
+            continue
+        if result["higher_is_better"]:
+            worse = result["value"] < former["value"] * (1 - tolerance)
+        else:
+            worse = result["value"] > former["value"] * (1 + tolerance)
+        if worse:
+            regressions[name] = (former["value"], result["value"])
+    return regressions
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", help="json file of the results",
+                        default="bench_results.json")
+    parser.add_argument("-r", "--requests",
+                        help="Alexa requests of the mapper and webhook runs",
+                        type=int, default=5000)
+    parser.add_argument("-u", "--utterances", help="utterances per nlu file",
+                        type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("-b", "--baseline",
+                        help="results of a former run to compare with")
+    parser.add_argument("-t", "--tolerance",
+                        help="accepted slowdown against the baseline",
+                        type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = readArgs()
+    results = run_suite(args)
+    with open(args.output, 'w') as writer:
+        json.dump({"meta": {"revision": git_revision(),
+                            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                                     time.gmtime()),
+                            "python": platform.python_version(),
+                            "platform": platform.platform()},
+                   "results": results}, writer, indent=2)
+    for name, result in results.items():
+        print(f'{name:24} {result["value"]:12.6f} {result["unit"]}')
+    print(f'Results saved to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as reader:
+            baseline = json.load(reader)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, (former, current) in regressions.items():
+            print(f'Regression of {name}: {former:.6f} -> {current:.6f}')
+        if regressions:
+            sys.exit(1)
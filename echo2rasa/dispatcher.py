@@ -0,0 +1,311 @@
+"""Front dispatcher of the echo channel for several Rasa worker processes.
+
+Every Alexa request is forwarded to the worker the userId hashes to on a
+consistent hash ring, so the turns of a user always meet the same warm
+tracker and never race for it on two workers. Workers failing several
+health checks in a row leave the ring and only their users move; they get
+them back once healthy again.
+
+run with
+python -m echo2rasa.dispatcher -n 4 --spawn "rasa run --connector echoconnector.EchoConnector --port {port}"
+python -m echo2rasa.dispatcher -w http://localhost:5006 -w http://localhost:5007
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+import shlex
+import subprocess
+from typing import Dict, List, Optional, Text
+
+import aiohttp
+from sanic import Sanic, response
+from sanic.request import Request
+
+from echo2rasa.echoconnector import AlexaRequestError, decode_alexa_request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5005
+DEFAULT_FIRST_WORKER_PORT = 5006
+DEFAULT_REPLICAS = 160
+DEFAULT_HEALTH_INTERVAL = 1.0
+# a worker busy with slow turns answers its health check late, it is only
+# evicted after several checks in a row failed or timed out
+DEFAULT_HEALTH_TIMEOUT = 5.0
+DEFAULT_HEALTH_FAILURES = 3
+DEFAULT_WORKER_TIMEOUT = 8.0
+WEBHOOK = "/webhooks/echo/webhook"
+HEALTH = "/webhooks/echo/"
+# headers Alexa signs its requests with, needed by the workers to verify them
+FORWARDED_HEADERS = ("Content-Type", "Signature", "Signature-256",
+                     "SignatureCertChainUrl")
+
+
+def ring_hash(key) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing(object):
+    """Consistent hash ring of worker names.
+
+    Every worker is placed on the ring replicas times. Adding or removing a
+    worker moves only the keys of the ring segments it owns."""
+
+    def __init__(self, nodes=(), replicas=DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self._nodes = set()
+        self._points = []    # sorted hashes of the ring
+        self._owners = {}    # hash -> node
+        for node in nodes:
+            self.add(node)
+
+    def __contains__(self, node) -> bool:
+        return node in self._nodes
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def add(self, node) -> None:
+        if node in self:
+            return
+        self._nodes.add(node)
+        for idx in range(self.replicas):
+            point = ring_hash("{}#{}".format(node, idx))
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node) -> None:
+        if node not in self:
+            return
+        self._nodes.discard(node)
+        for idx in range(self.replicas):
+            point = ring_hash("{}#{}".format(node, idx))
+            del self._owners[point]
+            del self._points[bisect.bisect_left(self._points, point)]
+
+    def nodes_for(self, key) -> List[Text]:
+        # The distinct nodes in ring order starting at the key, the first
+        # one owns the key, the others take over if it fails.
+        if not self._points:
+            return []
+        start = bisect.bisect(self._points, ring_hash(key))
+        nodes = []
+        for idx in range(len(self._points)):
+            node = self._owners[self._points[(start + idx) % len(self._points)]]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == len(self):
+                    break
+        return nodes
+
+    def node_for(self, key) -> Optional[Text]:
+        nodes = self.nodes_for(key)
+        return nodes[0] if nodes else None
+
+
+class WorkerProcess(object):
+    """A local worker started from a command line template and restarted
+    whenever it exits."""
+
+    def __init__(self, command, port):
+        self.command = shlex.split(command.format(port=port))
+        self.url = "http://localhost:{}".format(port)
+        self.process = None    # type: Optional[subprocess.Popen]
+        self.restarts = 0
+
+    def ensure_running(self) -> bool:
+        # Returns True if the worker had to be (re)started.
+        if self.process is not None and self.process.poll() is None:
+            return False
+        if self.process is not None:
+            self.restarts += 1
+            logger.warning("Worker %s exited with %s, restarting.",
+                           self.url, self.process.returncode)
+        self.process = subprocess.Popen(self.command)
+        return True
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+class EchoDispatcher(object):
+
+    def __init__(self, workers, replicas=DEFAULT_REPLICAS,
+                 health_interval=DEFAULT_HEALTH_INTERVAL,
+                 timeout=DEFAULT_WORKER_TIMEOUT, processes=(),
+                 health_timeout=DEFAULT_HEALTH_TIMEOUT,
+                 health_failures=DEFAULT_HEALTH_FAILURES):
+        self.workers = list(workers)
+        self.ring = HashRing(replicas=replicas)
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.health_failures = health_failures
+        self.timeout = timeout
+        self.processes = list(processes)
+        self.session = None    # type: Optional[aiohttp.ClientSession]
+        self.forwarded = {worker: 0 for worker in self.workers}
+        # health checks failed in a row per worker
+        self.failed_checks = {worker: 0 for worker in self.workers}
+        self.failovers = 0
+
+    async def start(self) -> None:
+        # keep-alive connections to the workers
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit_per_host=0,
+                                           keepalive_timeout=60))
+        await self.check_workers()
+
+    async def stop(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+        for process in self.processes:
+            process.stop()
+
+    async def is_healthy(self, worker) -> bool:
+        timeout = aiohttp.ClientTimeout(total=self.health_timeout)
+        try:
+            async with self.session.get(worker + HEALTH,
+                                        timeout=timeout) as resp:
+                return resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def check_workers(self) -> None:
+        for process in self.processes:
+            if process.ensure_running():
+                self.mark_down(process.url)
+        results = await asyncio.gather(
+            *[self.is_healthy(worker) for worker in self.workers])
+        for worker, healthy in zip(self.workers, results):
+            if healthy:
+                self.failed_checks[worker] = 0
+                if worker not in self.ring:
+                    logger.info("Worker %s joined the ring.", worker)
+                    self.ring.add(worker)
+            else:
+                self.failed_checks[worker] += 1
+                if self.failed_checks[worker] >= self.health_failures:
+                    self.mark_down(worker)
+
+    def mark_down(self, worker) -> None:
+        if worker in self.ring:
+            logger.warning("Worker %s left the ring.", worker)
+            self.ring.remove(worker)
+
+    async def monitor(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_workers()
+
+    async def forward(self, request: Request):
+        try:
+            alexa_request = decode_alexa_request(request.body)
+        except AlexaRequestError as e:
+            return response.json({"error": str(e)}, status=e.status)
+        sender_id = alexa_request.sender_id
+        headers = {name: request.headers[name] for name in FORWARDED_HEADERS
+                   if name in request.headers}
+        for worker in self.ring.nodes_for(sender_id or ""):
+            try:
+                async with self.session.post(worker + WEBHOOK,
+                                             data=request.body,
+                                             headers=headers) as resp:
+                    body = await resp.read()
+                    self.forwarded[worker] += 1
+                    return response.raw(
+                        body, status=resp.status,
+                        content_type=resp.headers.get(
+                            "Content-Type", "application/json"))
+            except aiohttp.ClientConnectionError:
+                # the next worker on the ring takes over the user
+                self.failovers += 1
+                self.mark_down(worker)
+            except asyncio.TimeoutError:
+                return response.json({"error": "worker timed out"},
+                                     status=504)
+        return response.json({"error": "no worker available"}, status=503)
+
+    def status(self) -> Dict:
+        return {"workers": {worker: {"in_ring": worker in self.ring,
+                                     "forwarded": self.forwarded[worker],
+                                     "failed_checks":
+                                         self.failed_checks[worker]}
+                            for worker in self.workers},
+                "failovers": self.failovers,
+                "restarts": sum(process.restarts
+                                for process in self.processes)}
+
+
+def create_app(dispatcher) -> Sanic:
+    app = Sanic(__name__, configure_logging=False)
+
+    @app.listener("before_server_start")
+    async def start(app, loop):
+        await dispatcher.start()
+        app.monitor = loop.create_task(dispatcher.monitor())
+
+    @app.listener("after_server_stop")
+    async def stop(app, loop):
+        app.monitor.cancel()
+        await dispatcher.stop()
+
+    # noinspection PyUnusedLocal
+    @app.route(HEALTH, methods=["GET"])
+    async def health(request: Request):
+        return response.json(dispatcher.status(),
+                             status=200 if len(dispatcher.ring) else 503)
+
+    @app.route(WEBHOOK, methods=["POST"])
+    async def webhook(request: Request):
+        return await dispatcher.forward(request)
+
+    return app
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--port", help="port of the dispatcher",
+                        type=int, default=DEFAULT_PORT)
+    parser.add_argument("-w", "--worker", action="append", default=[],
+                        help="url of a running worker, may be repeated")
+    parser.add_argument("-n", "--workers", help="worker processes to spawn",
+                        type=int, default=0)
+    parser.add_argument("--spawn", help="command line of a worker, {port} "
+                        "is replaced by its port")
+    parser.add_argument("--first-port", help="port of the first spawned "
+                        "worker", type=int, default=DEFAULT_FIRST_WORKER_PORT)
+    parser.add_argument("--replicas", help="ring points per worker",
+                        type=int, default=DEFAULT_REPLICAS)
+    parser.add_argument("--interval", help="seconds between health checks",
+                        type=float, default=DEFAULT_HEALTH_INTERVAL)
+    parser.add_argument("--timeout", help="seconds a worker may take",
+                        type=float, default=DEFAULT_WORKER_TIMEOUT)
+    parser.add_argument("--health-timeout", help="seconds a worker may take "
+                        "to answer its health check", type=float,
+                        default=DEFAULT_HEALTH_TIMEOUT)
+    parser.add_argument("--health-failures", help="failed health checks in "
+                        "a row evicting a worker", type=int,
+                        default=DEFAULT_HEALTH_FAILURES)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = readArgs()
+    processes = []
+    if args.workers:
+        if not args.spawn:
+            raise SystemExit("--workers needs the --spawn command line")
+        processes = [WorkerProcess(args.spawn, args.first_port + idx)
+                     for idx in range(args.workers)]
+    dispatcher = EchoDispatcher(
+        args.worker + [process.url for process in processes],
+        args.replicas, args.interval, args.timeout, processes,
+        args.health_timeout, args.health_failures)
+    create_app(dispatcher).run(host="0.0.0.0", port=args.port, workers=1)
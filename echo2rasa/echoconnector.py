@@ -6,39 +6,947 @@ from sanic import Sanic, Blueprint, response
 from rasa.core import utils
 from rasa.constants import DOCS_BASE_URL
 import rasa.utils.endpoints
+import rasa.utils.io
 from rasa.nlu.components import Component
+from rasa.nlu.utils import write_json_to_file
+import aiohttp
 import asyncio
 import inspect
+import ssl
 from rasa.core.channels.channel import InputChannel
 from rasa.core.channels.channel import QueueOutputChannel
 from rasa.core.channels.channel import CollectingOutputChannel
-from rasa.core.channels.channel import RestInput
 from asyncio import Queue
 from rasa.core.channels.channel import UserMessage
+from rasa.core.actions.action import ACTION_LISTEN_NAME
+from rasa.core.events import ActionExecuted
+from rasa.core.tracker_store import TrackerStore
+from rasa.core.trackers import DialogueStateTracker
+import base64
+import copy
+import hashlib
+import hmac
 import json
 import logging
+import os
+import posixpath
+import time
 import uuid
+import zlib
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from xml.sax.saxutils import escape
 from asyncio import Queue, CancelledError
 from typing import Text, List, Dict, Any,\
-    Optional, Callable, Iterable, Awaitable
+    Optional, Callable, Iterable, Awaitable, Tuple
+
+
+try:
+    import orjson
+
+    def encode_json(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def encode_json(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, padding
+except ImportError:
+    x509 = None
 
 
 logger = logging.getLogger(__name__)
 
+# Alexa request bodies are a few kilobytes. Anything far beyond that is
+# rejected before it gets decoded.
+DEFAULT_MAX_BODY_SIZE = 64 * 1024
+
+# Turns handled at the same time and turns allowed to wait for a free slot.
+# Further requests are answered with the busy message right away.
+DEFAULT_MAX_CONCURRENT_TURNS = 32
+DEFAULT_MAX_WAITING_TURNS = 64
+DEFAULT_BUSY_MESSAGE = "Sorry, I am busy right now. Please try again."
+
+# Alexa abandons a request after 8 seconds. The turn has to be answered
+# within this budget (seconds), counted from the request timestamp.
+DEFAULT_TURN_DEADLINE = 7.0
+# Alexa accepts request timestamps up to 150 seconds off. A request taking
+# longer than this (seconds) to arrive is taken for skewed clocks.
+MAX_TRANSIT_TIME = 2.0
+DEFAULT_TIMEOUT_MESSAGE = "Sorry, that took too long. Please say it again."
+
+# Responses kept for retries of the same Alexa requestId.
+DEFAULT_RESPONSE_CACHE_SIZE = 4096
+DEFAULT_RESPONSE_CACHE_TTL = 60.0
+
+# Intent a LaunchRequest ("Alexa, open ...") is mapped to.
+DEFAULT_LAUNCH_INTENT = "greet"
+
+# Stateless mode: the dialogue state travels in the Alexa sessionAttributes
+# (limited to 24 kB of the whole response). Larger snapshots are kept in
+# the tracker store instead.
+DEFAULT_MAX_STATE_SIZE = 8 * 1024
+DEFAULT_STATE_EVENTS = 20
+STATE_ATTRIBUTE = "rasa_state"
+
+# Verification of the Alexa request signature. The certificate chain of a
+# URL is fetched, validated and parsed once and kept for certificate_ttl
+# seconds (at most until it expires).
+DEFAULT_CERTIFICATE_CACHE_SIZE = 16
+DEFAULT_CERTIFICATE_TTL = 3600.0
+DEFAULT_TIMESTAMP_TOLERANCE = 150.0
+ALEXA_CERTIFICATE_HOST = "s3.amazonaws.com"
+ALEXA_CERTIFICATE_PATH = "/echo.api/"
+ALEXA_CERTIFICATE_SAN = "echo-api.amazon.com"
+
+# Bot messages of a streamed turn waiting to be written. A slow client
+# holds up the bot instead of piling up its messages.
+DEFAULT_STREAM_QUEUE_SIZE = 8
+
+# Compact sender ids: a keyed hash of the Alexa userId of 12 bytes, 16
+# characters instead of more than 200. The userIds of the latest senders
+# are kept to look them up while debugging.
+SENDER_ID_BYTES = 12
+DEFAULT_SENDER_CACHE_SIZE = 10000
+ALEXA_ID_PREFIX = "amzn1."
+
+
+class Histogram(object):
+    """Cumulative latency histogram with fixed bucket bounds (seconds)."""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.0, 4.0, 8.0, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for idx, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+
+    def as_dict(self):
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            total += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = total
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class EchoMetrics(object):
+    """Request counters, in-flight gauge and per-stage latency histograms.
+
+    The stages of an Alexa turn are "decode", "verify" (the request
+    signature), "nlu" (EchoNLUMapper),
+    "core" (the complete on_new_message call, including nlu) and "render"
+    (the mapping of the bot messages into the Alexa response). Streamed
+    turns add "ttfb", the time from receiving the request until the first
+    bot message is written."""
+
+    STAGES = ("decode", "verify", "nlu", "core", "render", "ttfb")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.in_flight = 0
+        self.histograms = {stage: Histogram() for stage in self.STAGES}
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, value):
+        self.histograms[stage].observe(value)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def as_dict(self):
+        return {
+            "counters": dict(self.counters),
+            "in_flight": self.in_flight,
+            "histograms": {stage: histogram.as_dict()
+                           for stage, histogram in self.histograms.items()},
+        }
+
+
+# Shared by the connector and the NLU mapper, both run within the same
+# Rasa server process.
+metrics = EchoMetrics()
+
+
+# Parsed Alexa requests handed over from the EchoConnector to the
+# EchoNLUMapper. Both live in the same Rasa server process, but the NLU
+# pipeline only gets to see the message text. Therefore the text carries the
+# Alexa requestId and the mapper picks the structured request up from here.
+_echo_requests = {}
+
+
+def register_echo_request(req) -> Text:
+    # Stores the request dict and returns the key to be used as message text.
+    key = req.get("requestId") or uuid.uuid4().hex
+    _echo_requests[key] = req
+    return key
+
+
+def release_echo_request(key) -> None:
+    _echo_requests.pop(key, None)
+
+
+def lookup_echo_request(text) -> Optional[Dict[Text, Any]]:
+    # Returns the Alexa request registered for a message text. Messages not
+    # routed through the EchoConnector (i.e. the curl examples within
+    # tests/service) still carry the request as json string. Plain text
+    # messages have no Alexa request.
+    req = _echo_requests.get(text)
+    if req is None:
+        try:
+            req = json.loads(text)
+        except (TypeError, ValueError):
+            return None
+    return req if isinstance(req, dict) else None
+
+
+class AlexaRequestError(ValueError):
+    """Raised if a webhook body is not a valid Alexa request."""
+
+    def __init__(self, message, status=400):
+        super(AlexaRequestError, self).__init__(message)
+        self.status = status
+
+
+class AlexaRequest(object):
+    """The parts of an Alexa webhook body needed to handle a turn.
+
+    Only the sender and the request object are extracted. Everything else
+    (access token, device, viewport, ...) stays within the decoded envelope
+    and is only looked at if somebody asks for it."""
+
+    __slots__ = ("sender_id", "request", "session", "_envelope")
+
+    def __init__(self, sender_id, request, session, envelope):
+        self.sender_id = sender_id
+        self.request = request
+        self.session = session
+        self._envelope = envelope
+
+    @property
+    def request_type(self) -> Optional[Text]:
+        return self.request.get("type")
+
+    @property
+    def request_id(self) -> Optional[Text]:
+        return self.request.get("requestId")
+
+    @property
+    def context(self) -> Dict[Text, Any]:
+        return self._envelope.get("context") or {}
+
+
+def decode_alexa_request(body, max_body_size=DEFAULT_MAX_BODY_SIZE):
+    """Decode an Alexa webhook body into an AlexaRequest.
+
+    Oversized bodies are rejected before they are parsed."""
+
+    if not body:
+        raise AlexaRequestError("Empty request body.")
+    if len(body) > max_body_size:
+        raise AlexaRequestError(
+            "Request body of {} bytes exceeds the limit of {} bytes."
+            "".format(len(body), max_body_size), status=413)
+    try:
+        envelope = json.loads(body)
+    except ValueError as e:
+        raise AlexaRequestError("Request body is no valid json: {}".format(e))
+
+    if not isinstance(envelope, dict):
+        raise AlexaRequestError("Request body is no json object.")
+    request = envelope.get("request")
+    if not isinstance(request, dict):
+        raise AlexaRequestError("Request body contains no Alexa request.")
+
+    # Requests outside of a skill session (i.e. AudioPlayer events) only
+    # carry the user within the context.
+    session = envelope.get("session") or {}
+    user = session.get("user") or \
+        (envelope.get("context") or {}).get("System", {}).get("user") or {}
+    sender_id = user.get("userId")
+    if sender_id is None:
+        raise AlexaRequestError("Request body contains no Alexa userId.")
+    return AlexaRequest(sender_id, request, session, envelope)
+
+
+class AlexaResponseRenderer(object):
+    """Renders the bot messages of a turn into an Alexa response body.
+
+    The static part of the response is encoded once per combination of
+    session status, shouldEndSession and playBehavior. Rendering a turn only
+    encodes the speech (and the session attributes, if given) and splices
+    it into the prepared envelope."""
+
+    _SPEECH = "@@speech@@"
+    _ATTRIBUTES = "@@attributes@@"
 
-def getJsonObject(obj):
-    # Returns a json string representation of the obj.
-    # To prevent issues with single quotation marks, these are replaced
-    # by double quotation marks if needed (not every occurance of a single
-    # quotation mark maybe reblaced!).
+    def __init__(self, version="0.1"):
+        self.version = version
+        self._envelopes = {}
+        self._ssml = {}
 
-    if (obj is None):
+    @staticmethod
+    def to_ssml(text) -> Text:
+        return "<speak>{}</speak>".format(" ".join(escape(text).split()))
+
+    def compile_templates(self, domain_file) -> None:
+        # Converts the utter_* templates of the domain into SSML up front.
+        # Templates containing slot values are converted per response.
+        domain = rasa.utils.io.read_yaml_file(domain_file)
+        for name, variants in (domain.get("templates") or {}).items():
+            if not name.startswith("utter_"):
+                continue
+            for variant in variants:
+                text = variant.get("text")
+                if text:
+                    self._ssml[text] = self.to_ssml(text)
+
+    def _compile_envelope(self, key) -> List[bytes]:
+        # Returns the envelope split around the session attributes and the
+        # speech, followed by the default session attributes.
+        status, should_end_session, play_behavior = key
+        speech = {
+            "type": "SSML",
+            "ssml": self._SPEECH,
+            "playBehavior": play_behavior
+        }
+        envelope = encode_json({
+            "version": self.version,
+            "sessionAttributes": self._ATTRIBUTES,
+            "response": {
+                "outputSpeech": speech,
+                "reprompt": {
+                    "outputSpeech": speech
+                },
+                "shouldEndSession": should_end_session
+            }
+        })
+        head, rest = envelope.split(encode_json(self._ATTRIBUTES))
+        parts = rest.split(encode_json(self._SPEECH))
+        parts = [head, parts[0], parts[1], parts[2],
+                 encode_json({"status": status})]
+        self._envelopes[key] = parts
+        return parts
+
+    def render(self, messages, status="test", should_end_session=False,
+               play_behavior="REPLACE_ENQUEUED",
+               session_attributes=None) -> bytes:
+        key = (status, should_end_session, play_behavior)
+        head, middle, between, tail, attributes = \
+            self._envelopes.get(key) or self._compile_envelope(key)
+        if session_attributes is not None:
+            attributes = encode_json(dict(session_attributes, status=status))
+        text = " ".join(m["text"] for m in messages if m.get("text"))
+        ssml = encode_json(self._ssml.get(text) or self.to_ssml(text))
+        return b"".join((head, attributes, middle, ssml, between, ssml,
+                         tail))
+
+    def render_acknowledgement(self) -> bytes:
+        # Response without any speech, i.e. for a SessionEndedRequest.
+        return encode_json({"version": self.version, "response": {}})
+
+
+class TurnLimitExceeded(Exception):
+    """Raised if a turn can neither run nor wait for a free slot."""
+
+
+class EndOfStream(object):
+    """Ends the bot messages of a streamed turn, with the error that ended
+    the turn, if any."""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+class TurnController(object):
+    """Serializes the turns of a sender and bounds the turns in flight.
+
+    A turn first waits for the lock of its sender, so two turns of one
+    tracker never interleave, and then for one of the global slots. Locks
+    are dropped as soon as no turn of the sender is left. If all slots are
+    taken and the wait queue is full, TurnLimitExceeded is raised."""
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT_TURNS,
+                 max_waiting=DEFAULT_MAX_WAITING_TURNS):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self._locks = {}  # sender_id -> [lock, number of turns]
+        # created lazily, to be bound to the loop of the running server
+        self._semaphore = None
+
+    @asynccontextmanager
+    async def turn(self, sender_id):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self.waiting >= self.max_waiting and self._semaphore.locked():
+            raise TurnLimitExceeded(
+                "{} turns waiting for a free slot.".format(self.waiting))
+
+        entry = self._locks.get(sender_id)
+        if entry is None:
+            entry = self._locks[sender_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.waiting += 1
+        waiting = True
+        try:
+            async with entry[0]:
+                async with self._semaphore:
+                    self.waiting -= 1
+                    waiting = False
+                    yield
+        finally:
+            if waiting:
+                self.waiting -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[sender_id]
+
+
+def parse_timestamp(timestamp) -> Optional[float]:
+    # Seconds since the epoch of an Alexa request timestamp.
+    try:
+        sent = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+    except (TypeError, ValueError):
         return None
-    jString = str(obj).replace("{'", '{"').replace("':", '":')\
-        .replace(", '", ', "')\
-        .replace(": '", ': "').replace("', ", '", ').replace("'}", '"}')
-    print("jString: " + jString)
-    return json.loads(jString)
+    return sent.replace(tzinfo=timezone.utc).timestamp()
+
+
+def remaining_budget(timestamp, budget, now=None) -> float:
+    """Seconds left for a turn of an Alexa request sent at timestamp.
+
+    Only the transit time of the request is charged. A request sent "in
+    the future" or taking longer than MAX_TRANSIT_TIME to arrive is taken
+    for skewed clocks and gets the full budget."""
+
+    if now is None:
+        now = time.time()
+    sent = parse_timestamp(timestamp)
+    if sent is None:
+        return budget
+    transit = now - sent
+    if transit < 0 or transit > MAX_TRANSIT_TIME:
+        return budget
+    return max(budget - transit, 0.0)
+
+
+class ResponseCache(object):
+    """LRU cache of Alexa responses by requestId.
+
+    Entries expire ttl seconds after they have been stored. Values are the
+    rendered response body or the task of a turn still in flight."""
+
+    def __init__(self, max_entries=DEFAULT_RESPONSE_CACHE_SIZE,
+                 ttl=DEFAULT_RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # request_id -> (expires, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now=None):
+        entry = self._entries.get(key)
+        if now is None:
+            now = time.monotonic()
+        if entry is not None and entry[0] < now:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, now=None, ttl=None):
+        if now is None:
+            now = time.monotonic()
+        self._entries[key] = (now + (self.ttl if ttl is None else ttl),
+                              value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def as_dict(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries)}
+
+
+def validate_certificate_url(url) -> None:
+    # The certificate chain of an Alexa request has to be hosted by Amazon.
+    parsed = urlparse(url or "")
+    path = posixpath.normpath(parsed.path) if parsed.path else ""
+    try:
+        port = parsed.port
+    except ValueError:
+        # a port out of range or no number at all
+        port = -1
+    if parsed.scheme.lower() != "https" or \
+            (parsed.hostname or "").lower() != ALEXA_CERTIFICATE_HOST or \
+            not path.startswith(ALEXA_CERTIFICATE_PATH) or \
+            port not in (None, 443):
+        raise AlexaRequestError("Invalid certificate url {}".format(url))
+
+
+def load_certificates(pem) -> List[Any]:
+    marker = b"-----END CERTIFICATE-----"
+    return [x509.load_pem_x509_certificate(block + marker, default_backend())
+            for block in pem.split(marker) if block.strip()]
+
+
+def load_trusted_roots(ca_file=None) -> Dict[Any, Any]:
+    # Root certificates by subject, from ca_file or the default CA bundle.
+    if ca_file is None:
+        try:
+            import certifi
+            ca_file = certifi.where()
+        except ImportError:
+            ca_file = ssl.get_default_verify_paths().cafile
+    if ca_file is None or not os.path.exists(ca_file):
+        raise ValueError("No CA bundle to verify Alexa certificates with")
+    with open(ca_file, "rb") as f:
+        pem = f.read()
+    roots = {}
+    for certificate in load_certificates(pem):
+        roots[certificate.subject] = certificate
+    return roots
+
+
+def verify_certificate_signature(certificate, issuer) -> None:
+    key = issuer.public_key()
+    try:
+        if isinstance(key, ec.EllipticCurvePublicKey):
+            key.verify(certificate.signature,
+                       certificate.tbs_certificate_bytes,
+                       ec.ECDSA(certificate.signature_hash_algorithm))
+        else:
+            key.verify(certificate.signature,
+                       certificate.tbs_certificate_bytes,
+                       padding.PKCS1v15(),
+                       certificate.signature_hash_algorithm)
+    except InvalidSignature:
+        raise AlexaRequestError("Invalid certificate chain")
+
+
+def validity(certificate) -> Tuple[float, float]:
+    # Seconds since the epoch a certificate is valid from and until.
+    start = getattr(certificate, "not_valid_before_utc", None) or \
+        certificate.not_valid_before.replace(tzinfo=timezone.utc)
+    end = getattr(certificate, "not_valid_after_utc", None) or \
+        certificate.not_valid_after.replace(tzinfo=timezone.utc)
+    return start.timestamp(), end.timestamp()
+
+
+def validate_certificate_chain(pem, roots, now=None):
+    """Validates the certificate chain of an Alexa request and returns the
+    public key of the signing certificate and the time it expires."""
+
+    now = time.time() if now is None else now
+    try:
+        chain = load_certificates(pem)
+    except ValueError as e:
+        raise AlexaRequestError("Invalid certificate chain: {}".format(e))
+    if not chain:
+        raise AlexaRequestError("Empty certificate chain")
+    for certificate in chain:
+        start, end = validity(certificate)
+        if not start <= now <= end:
+            raise AlexaRequestError("Certificate expired or not yet valid")
+    try:
+        names = chain[0].extensions.get_extension_for_class(
+            x509.SubjectAlternativeName).value.get_values_for_type(
+            x509.DNSName)
+    except x509.ExtensionNotFound:
+        names = []
+    if ALEXA_CERTIFICATE_SAN not in names:
+        raise AlexaRequestError("Certificate not issued to Alexa")
+    for certificate, issuer in zip(chain, chain[1:]):
+        verify_certificate_signature(certificate, issuer)
+    top = chain[-1]
+    if roots.get(top.subject) != top:
+        root = roots.get(top.issuer)
+        if root is None:
+            raise AlexaRequestError("Untrusted certificate chain")
+        verify_certificate_signature(top, root)
+    return chain[0].public_key(), validity(chain[0])[1]
+
+
+def verify_request_signature(public_key, signature, body, algorithm) -> bool:
+    try:
+        public_key.verify(base64.b64decode(signature), body,
+                          padding.PKCS1v15(), algorithm())
+        return True
+    except (InvalidSignature, ValueError):
+        return False
+
+
+class AlexaRequestVerifier(object):
+    """Verifies the signature and timestamp of Alexa requests.
+
+    Certificate chains are fetched asynchronously (from a local stand-in of
+    the Amazon host, if certificate_source is set), validated once and kept
+    in a cache by URL. Validation and signature checks run on the executor
+    of the event loop."""
+
+    def __init__(self, ca_file=None, certificate_source=None,
+                 cache_size=DEFAULT_CERTIFICATE_CACHE_SIZE,
+                 cache_ttl=DEFAULT_CERTIFICATE_TTL,
+                 tolerance=DEFAULT_TIMESTAMP_TOLERANCE):
+        if x509 is None:
+            raise ImportError("Verifying Alexa requests needs the "
+                              "cryptography package")
+        self.roots = load_trusted_roots(ca_file)
+        self.certificate_source = certificate_source
+        self.certificates = ResponseCache(cache_size, cache_ttl)
+        self.tolerance = tolerance
+        self._session = None
+
+    async def fetch(self, url) -> bytes:
+        if self.certificate_source is not None:
+            url = self.certificate_source.rstrip("/") + urlparse(url).path
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=2.0))
+        try:
+            async with self._session.get(url) as resp:
+                if resp.status != 200:
+                    raise AlexaRequestError(
+                        "Fetching certificate {} failed with {}".format(
+                            url, resp.status))
+                return await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise AlexaRequestError(
+                "Fetching certificate {} failed: {}".format(url, e))
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _load(self, url):
+        pem = await self.fetch(url)
+        return await asyncio.get_event_loop().run_in_executor(
+            None, validate_certificate_chain, pem, self.roots)
+
+    def _loaded(self, url, task) -> None:
+        if task.cancelled() or task.exception() is not None:
+            self.certificates.discard(url)
+        else:
+            public_key, expires = task.result()
+            self.certificates.put(url, public_key,
+                                  ttl=min(self.certificates.ttl,
+                                          expires - time.time()))
+
+    async def public_key(self, url):
+        # Concurrent requests of a new URL share a single fetch.
+        cached = self.certificates.get(url)
+        if cached is None:
+            cached = asyncio.ensure_future(self._load(url))
+            self.certificates.put(url, cached)
+            cached.add_done_callback(lambda t: self._loaded(url, t))
+        if isinstance(cached, asyncio.Future):
+            public_key, _ = await asyncio.shield(cached)
+            return public_key
+        return cached
+
+    async def verify(self, headers, body, alexa_request, now=None) -> None:
+        # Raises an AlexaRequestError if the request is not from Alexa.
+        sent = parse_timestamp(alexa_request.request.get("timestamp"))
+        now = time.time() if now is None else now
+        if sent is None or abs(now - sent) > self.tolerance:
+            raise AlexaRequestError("Request timestamp out of tolerance")
+        url = headers.get("SignatureCertChainUrl")
+        validate_certificate_url(url)
+        signature = headers.get("Signature-256")
+        algorithm = hashes.SHA256
+        if signature is None:
+            signature = headers.get("Signature")
+            algorithm = hashes.SHA1
+        if not signature:
+            raise AlexaRequestError("Missing request signature")
+        public_key = await self.public_key(url)
+        verified = await asyncio.get_event_loop().run_in_executor(
+            None, verify_request_signature, public_key, signature, body,
+            algorithm)
+        if not verified:
+            raise AlexaRequestError("Invalid request signature")
+
+
+class SenderIdentities(object):
+    """Maps Alexa userIds to short, stable sender ids.
+
+    The sender id is a BLAKE2b hash of the userId, keyed with the secret, so
+    all instances sharing the secret agree on it. A bounded mapping of the
+    latest sender ids back to their userIds is kept for debugging."""
+
+    def __init__(self, secret=None, max_entries=DEFAULT_SENDER_CACHE_SIZE):
+        # BLAKE2b takes keys of up to 64 bytes
+        self._key = hashlib.blake2b(secret.encode("utf-8")).digest() \
+            if secret else b""
+        self.max_entries = max_entries
+        self._users = OrderedDict()  # sender id -> userId
+
+    def __len__(self):
+        return len(self._users)
+
+    def sender_id(self, user_id) -> Text:
+        digest = hashlib.blake2b(user_id.encode("utf-8"),
+                                 digest_size=SENDER_ID_BYTES,
+                                 key=self._key).digest()
+        return base64.urlsafe_b64encode(digest).decode("ascii")
+
+    def identify(self, user_id) -> Tuple[Text, bool]:
+        # Returns the sender id of a userId and whether it was unknown.
+        sender_id = self.sender_id(user_id)
+        new = sender_id not in self._users
+        self._users[sender_id] = user_id
+        self._users.move_to_end(sender_id)
+        while len(self._users) > self.max_entries:
+            self._users.popitem(last=False)
+        return sender_id, new
+
+    def user_id(self, sender_id) -> Optional[Text]:
+        return self._users.get(sender_id)
+
+
+def migrate_tracker(tracker_store, user_id, sender_id) -> bool:
+    # Saves the tracker of a userId as the tracker of its sender id, unless
+    # the sender id has one already. The old tracker is left untouched.
+    if isinstance(tracker_store, SnapshotTrackerStore):
+        tracker_store = tracker_store.store
+    if tracker_store.retrieve(sender_id) is not None:
+        return False
+    tracker = tracker_store.retrieve(user_id)
+    if tracker is None:
+        return False
+    tracker.sender_id = sender_id
+    # The event broker has seen the events under the userId already, the
+    # copy is saved by a shallow copy of the store without the broker.
+    quiet_store = copy.copy(tracker_store)
+    quiet_store.event_broker = None
+    quiet_store.save(tracker)
+    return True
+
+
+def migrate_tracker_store(tracker_store, identities) -> int:
+    """Copies the trackers kept by Alexa userId to their sender ids and
+    returns the number of trackers copied."""
+
+    migrated = 0
+    for key in list(tracker_store.keys()):
+        if key.startswith(ALEXA_ID_PREFIX) and migrate_tracker(
+                tracker_store, key, identities.sender_id(key)):
+            migrated += 1
+    return migrated
+
+
+class DialogueStateCodec(object):
+    """Encodes the dialogue state of a tracker into a compact token.
+
+    The snapshot holds the set slots, the active form and the latest
+    events. It is compressed, signed with a shared secret, so a client
+    can't tamper with it, and base64 encoded for the sessionAttributes."""
+
+    _MAC_SIZE = 16
+
+    def __init__(self, secret, max_size=DEFAULT_MAX_STATE_SIZE,
+                 max_events=DEFAULT_STATE_EVENTS):
+        self.secret = secret.encode("utf-8")
+        self.max_size = max_size
+        self.max_events = max_events
+
+    def _mac(self, data) -> bytes:
+        return hmac.new(self.secret, data,
+                        hashlib.sha256).digest()[:self._MAC_SIZE]
+
+    @staticmethod
+    def _compact(event) -> Dict[Text, Any]:
+        return {key: value for key, value in event.as_dict().items()
+                if value is not None and key != "timestamp"}
+
+    def encode(self, tracker) -> Optional[Text]:
+        # Returns None if the token would exceed max_size.
+        snapshot = {
+            "slots": {name: value for name, value in
+                      tracker.current_slot_values().items()
+                      if value is not None},
+            "form": tracker.active_form.get("name"),
+            "events": [self._compact(event) for event in
+                       list(tracker.events)[-self.max_events:]]
+        }
+        data = zlib.compress(
+            json.dumps(snapshot, separators=(",", ":")).encode("utf-8"), 9)
+        token = base64.urlsafe_b64encode(self._mac(data) + data)
+        if len(token) > self.max_size:
+            return None
+        return token.decode("ascii")
+
+    def decode(self, token) -> Optional[List[Dict[Text, Any]]]:
+        # Returns the events restoring the snapshot or None if the token
+        # is invalid.
+        try:
+            raw = base64.urlsafe_b64decode(token.encode("ascii"))
+            mac, data = raw[:self._MAC_SIZE], raw[self._MAC_SIZE:]
+            if not hmac.compare_digest(mac, self._mac(data)):
+                return None
+            snapshot = json.loads(zlib.decompress(data).decode("utf-8"))
+        except (ValueError, TypeError, AttributeError, zlib.error):
+            return None
+        events = [{"event": "slot", "name": name, "value": value}
+                  for name, value in snapshot["slots"].items()]
+        if snapshot.get("form"):
+            events.append({"event": "form", "name": snapshot["form"]})
+        return events + snapshot["events"]
+
+
+class SnapshotTrackerStore(TrackerStore):
+    """Tracker store of the stateless mode.
+
+    Trackers restored from a snapshot of the sessionAttributes are kept
+    locally for the turn, all others are read from and written to the
+    wrapped tracker store."""
+
+    def __init__(self, store):
+        super(SnapshotTrackerStore, self).__init__(store.domain,
+                                                   store.event_broker)
+        self.store = store
+        self._local = {}
+
+    def restore(self, sender_id, events=None) -> None:
+        # Takes over the tracker of a sender for a turn, a new one if there
+        # are no events.
+        if events is None:
+            tracker = self.init_tracker(sender_id)
+            tracker.update(ActionExecuted(ACTION_LISTEN_NAME))
+        else:
+            tracker = DialogueStateTracker.from_dict(
+                sender_id, events, self.domain.slots)
+        self._local[sender_id] = self.serialise_tracker(tracker)
+
+    def release(self, sender_id, write_through=False):
+        # Returns the tracker after a turn. Written to the wrapped store if
+        # it can't be handed over in the sessionAttributes.
+        serialised = self._local.pop(sender_id, None)
+        if serialised is None:
+            return None
+        tracker = self.deserialise_tracker(sender_id, serialised)
+        if write_through:
+            self.store.save(tracker)
+        return tracker
+
+    def save(self, tracker) -> None:
+        if tracker.sender_id not in self._local:
+            self.store.save(tracker)
+            return
+        if self.event_broker:
+            self.stream_events(tracker)
+        self._local[tracker.sender_id] = self.serialise_tracker(tracker)
+
+    def retrieve(self, sender_id) -> Optional[DialogueStateTracker]:
+        serialised = self._local.get(sender_id)
+        if serialised is None:
+            return self.store.retrieve(sender_id)
+        return self.deserialise_tracker(sender_id, serialised)
+
+    def keys(self) -> Iterable[Text]:
+        return self.store.keys()
+
+
+def install_snapshot_tracker_store(agent) -> Optional[SnapshotTrackerStore]:
+    # Like the interpreter, the tracker store is taken from the agent for
+    # every message.
+    if agent is None or agent.tracker_store is None:
+        return None
+    if not isinstance(agent.tracker_store, SnapshotTrackerStore):
+        agent.tracker_store = SnapshotTrackerStore(agent.tracker_store)
+    return agent.tracker_store
+
+
+class EchoInterpreter(NaturalLanguageInterpreter):
+    """Interpreter for the messages of the EchoConnector.
+
+    Alexa already recognized intent and entities of an Echo message, so its
+    parse result is built straight from the Alexa request by the
+    EchoNLUMapper. The wrapped interpreter (i.e. the trained Rasa NLU
+    pipeline) is only asked for messages of other channels."""
+
+    def __init__(self, interpreter=None, launch_intent=None):
+        self.interpreter = interpreter
+        # intent of a LaunchRequest, the one of the mapper if None
+        self.launch_intent = launch_intent
+        self._mapper = None
+
+    @property
+    def mapper(self):
+        # Prefer the configured mapper of the NLU pipeline, if there is one.
+        if self._mapper is None:
+            nlu = getattr(self.interpreter, "interpreter", None)
+            for component in getattr(nlu, "pipeline", None) or []:
+                if isinstance(component, EchoNLUMapper):
+                    self._mapper = component
+                    break
+            else:
+                self._mapper = EchoNLUMapper()
+        return self._mapper
+
+    async def parse(self, text, message_id=None):
+        req = _echo_requests.get(text)
+        if req is None:
+            return await self.interpreter.parse(text, message_id)
+
+        with metrics.time("nlu"):
+            intentName, entities = self.mapper.map_request(
+                req, self.launch_intent)
+        intent = {"name": intentName, "confidence": 1.0}
+        return {
+            "text": text,
+            "intent": intent,
+            "intent_ranking": [intent],
+            "entities": entities
+        }
+
+
+def install_echo_interpreter(agent, launch_intent=None) -> None:
+    # The agent creates a processor with its interpreter for every message,
+    # therefore wrapping the interpreter of the (re)loaded agent suffices.
+    if agent is None or agent.interpreter is None or \
+            isinstance(agent.interpreter, EchoInterpreter):
+        return
+    agent.interpreter = EchoInterpreter(agent.interpreter, launch_intent)
 
 
 class EchoConnector(InputChannel):
@@ -52,25 +960,136 @@ class EchoConnector(InputChannel):
     def name(cls):
         return "echo"
 
-    @staticmethod
+    @classmethod
+    def from_credentials(cls, credentials):
+        credentials = credentials or {}
+        return cls(
+            max_body_size=credentials.get(
+                "max_body_size", DEFAULT_MAX_BODY_SIZE),
+            domain_file=credentials.get("domain"),
+            max_concurrent_turns=credentials.get(
+                "max_concurrent_turns", DEFAULT_MAX_CONCURRENT_TURNS),
+            max_waiting_turns=credentials.get(
+                "max_waiting_turns", DEFAULT_MAX_WAITING_TURNS),
+            busy_message=credentials.get(
+                "busy_message", DEFAULT_BUSY_MESSAGE),
+            turn_deadline=credentials.get(
+                "turn_deadline", DEFAULT_TURN_DEADLINE),
+            timeout_message=credentials.get(
+                "timeout_message", DEFAULT_TIMEOUT_MESSAGE),
+            response_cache_size=credentials.get(
+                "response_cache_size", DEFAULT_RESPONSE_CACHE_SIZE),
+            response_cache_ttl=credentials.get(
+                "response_cache_ttl", DEFAULT_RESPONSE_CACHE_TTL),
+            launch_intent=credentials.get(
+                "launch_intent", DEFAULT_LAUNCH_INTENT),
+            bypass_nlu=credentials.get("bypass_nlu", True),
+            state_secret=credentials.get("state_secret")
+            if credentials.get("stateless", False) else None,
+            max_state_size=credentials.get(
+                "max_state_size", DEFAULT_MAX_STATE_SIZE),
+            state_events=credentials.get(
+                "state_events", DEFAULT_STATE_EVENTS),
+            stream_queue_size=credentials.get(
+                "stream_queue_size", DEFAULT_STREAM_QUEUE_SIZE),
+            identities=SenderIdentities(
+                credentials.get("sender_secret"),
+                credentials.get("sender_cache_size",
+                                DEFAULT_SENDER_CACHE_SIZE))
+            if credentials.get("compact_sender_ids", False) else None,
+            migrate_senders=credentials.get("migrate_senders", True),
+            verifier=AlexaRequestVerifier(
+                credentials.get("ca_file"),
+                credentials.get("certificate_source"),
+                credentials.get("certificate_cache_size",
+                                DEFAULT_CERTIFICATE_CACHE_SIZE),
+                credentials.get("certificate_ttl", DEFAULT_CERTIFICATE_TTL),
+                credentials.get("timestamp_tolerance",
+                                DEFAULT_TIMESTAMP_TOLERANCE))
+            if credentials.get("verify_requests", False) else None)
+
+    def __init__(self, max_body_size=DEFAULT_MAX_BODY_SIZE, domain_file=None,
+                 max_concurrent_turns=DEFAULT_MAX_CONCURRENT_TURNS,
+                 max_waiting_turns=DEFAULT_MAX_WAITING_TURNS,
+                 busy_message=DEFAULT_BUSY_MESSAGE,
+                 turn_deadline=DEFAULT_TURN_DEADLINE,
+                 timeout_message=DEFAULT_TIMEOUT_MESSAGE,
+                 response_cache_size=DEFAULT_RESPONSE_CACHE_SIZE,
+                 response_cache_ttl=DEFAULT_RESPONSE_CACHE_TTL,
+                 launch_intent=DEFAULT_LAUNCH_INTENT,
+                 bypass_nlu=True, state_secret=None,
+                 max_state_size=DEFAULT_MAX_STATE_SIZE,
+                 state_events=DEFAULT_STATE_EVENTS,
+                 stream_queue_size=DEFAULT_STREAM_QUEUE_SIZE, verifier=None,
+                 identities=None, migrate_senders=True):
+        self.max_body_size = max_body_size
+        self.renderer = AlexaResponseRenderer()
+        if domain_file is not None:
+            self.renderer.compile_templates(domain_file)
+        self.turns = TurnController(max_concurrent_turns, max_waiting_turns)
+        self.busy_response = self.renderer.render([{"text": busy_message}])
+        self.turn_deadline = turn_deadline
+        self.timeout_message = timeout_message
+        self.timeout_response = self.renderer.render(
+            [{"text": timeout_message}])
+        self.responses = ResponseCache(response_cache_size, response_cache_ttl)
+        self.launch_intent = launch_intent
+        self.acknowledgement = self.renderer.render_acknowledgement()
+        self.bypass_nlu = bypass_nlu
+        self.stream_queue_size = stream_queue_size
+        self.verifier = verifier
+        # short sender ids instead of the Alexa userIds, if given
+        self.identities = identities
+        self.migrate_senders = migrate_senders
+        # stateless mode if there is a secret to sign the state snapshots
+        self.state_codec = DialogueStateCodec(
+            state_secret, max_state_size, state_events) \
+            if state_secret else None
+
     async def on_message_wrapper(
+        self,
         on_new_message: Callable[[UserMessage], Awaitable[None]],
-        text: Text,
+        alexa_request: AlexaRequest,
         queue: Queue,
-        sender_id: Text,
+        parse_data: Optional[Dict[Text, Any]] = None,
     ) -> None:
-        collector = QueueOutputChannel(queue)
-
-        message = UserMessage(
-            text, collector, sender_id, input_channel=RestInput.name()
-        )
-        await on_new_message(message)
-
-        await queue.put("DONE")  # pytype: disable=bad-return-type
+        # Runs a streamed turn, its bot messages are put on the queue and
+        # followed by an EndOfStream.
+        req = alexa_request.request
+        sender_id = alexa_request.sender_id
+        key = register_echo_request(req)
+        error = None
+        # noinspection PyBroadException
+        try:
+            async with self.turns.turn(sender_id):
+                with metrics.time("core"):
+                    await on_new_message(
+                        UserMessage(
+                            key, QueueOutputChannel(queue), sender_id,
+                            parse_data=parse_data,
+                            input_channel=self.name(),
+                            message_id=key
+                        )
+                    )
+        except TurnLimitExceeded as e:
+            metrics.inc("shed")
+            logger.warning("Shedding Alexa request: %s", e)
+            error = e
+        except CancelledError:
+            raise
+        except Exception as e:
+            metrics.inc("errors")
+            logger.exception(
+                "An exception occured while handling "
+                "user message '%s'.", req
+            )
+            error = e
+        finally:
+            release_echo_request(key)
+        await queue.put(EndOfStream(error))
 
-    async def _extract_sender(self, req) -> Optional[Text]:
-        # return req.json.get("sender", None)
-        return req.json.get("session")["user"]["userId"]
+    async def _extract_sender(self, req: AlexaRequest) -> Optional[Text]:
+        return req.sender_id
 
     # noinspection PyMethodMayBeStatic
     def _extract_message(self, req):
@@ -79,21 +1098,48 @@ class EchoConnector(InputChannel):
     def stream_response(
         self,
         on_new_message: Callable[[UserMessage], Awaitable[None]],
-        text: Text,
-        sender_id: Text,
+        alexa_request: AlexaRequest,
+        parse_data: Optional[Dict[Text, Any]] = None,
+        received_at: Optional[float] = None,
     ) -> Callable[[Any], Awaitable[None]]:
+        """Streams every bot message of a turn as Alexa response, one per
+        line. The bot waits while the queue of unwritten messages is full,
+        a disconnecting client cancels the turn."""
+
         async def stream(resp: Any) -> None:
-            q = Queue()
-            task = asyncio.ensure_future(
-                self.on_message_wrapper(on_new_message, text, q, sender_id)
-            )
-            while True:
-                result = await q.get()  # pytype: disable=bad-return-type
-                if result == "DONE":
-                    break
-                else:
-                    await resp.write(json.dumps(result) + "\n")
-            await task
+            queue = Queue(maxsize=self.stream_queue_size)
+            task = asyncio.ensure_future(self.on_message_wrapper(
+                on_new_message, alexa_request, queue, parse_data))
+            start = received_at if received_at is not None else time.time()
+            written = 0
+            try:
+                while True:
+                    message = await queue.get()
+                    if isinstance(message, EndOfStream):
+                        break
+                    with metrics.time("render"):
+                        body = self.renderer.render([message])
+                    await resp.write(body + b"\n")
+                    if not written:
+                        metrics.observe("ttfb", time.time() - start)
+                    written += 1
+                if not written:
+                    # same fallbacks as a turn without streaming
+                    if isinstance(message.error, TurnLimitExceeded):
+                        body = self.busy_response
+                    else:
+                        metrics.inc("fallback")
+                        metrics.inc("fallback_empty")
+                        body = self.timeout_response
+                    await resp.write(body + b"\n")
+                    metrics.observe("ttfb", time.time() - start)
+            finally:
+                if not task.done():
+                    metrics.inc("stream_cancelled")
+                    logger.debug("Stream of sender %s closed, cancelling "
+                                 "its turn.", alexa_request.sender_id)
+                    task.cancel()
+                    await asyncio.wait([task])
 
         return stream  # pytype: disable=bad-return-type
 
@@ -109,100 +1155,365 @@ class EchoConnector(InputChannel):
         async def health(request: Request):
             return response.json({"status": "ok"})
 
+        if self.verifier is not None:
+            # noinspection PyUnusedLocal
+            @custom_webhook.listener("after_server_stop")
+            async def close_verifier(app, loop):
+                await self.verifier.close()
+
+        # noinspection PyUnusedLocal
+        @custom_webhook.route("/metrics", methods=["GET"])
+        async def get_metrics(request: Request):
+            result = metrics.as_dict()
+            result["waiting"] = self.turns.waiting
+            result["response_cache"] = self.responses.as_dict()
+            if self.verifier is not None:
+                result["certificate_cache"] = \
+                    self.verifier.certificates.as_dict()
+            if self.identities is not None:
+                result["senders"] = len(self.identities)
+            return response.json(result)
+
         @custom_webhook.route("/webhook", methods=["POST"])
         async def receive(request: Request):
-            print(f"dumping request: {request}")
-            print(request.json)
-            sender_id = await self._extract_sender(request)
-            # sender_id = request.json.get("session")["user"]["userId"]
-            print("sender_id: "+sender_id)
-            req = request.json.get("request")
+            metrics.inc("requests")
+            metrics.in_flight += 1
+            try:
+                return await handle(request, time.time())
+            finally:
+                metrics.in_flight -= 1
+
+        async def handle(request: Request, received_at):
+            try:
+                with metrics.time("decode"):
+                    alexa_request = decode_alexa_request(
+                        request.body, self.max_body_size)
+            except AlexaRequestError as e:
+                metrics.inc("rejected")
+                logger.warning("Rejected Alexa request: %s", e)
+                return response.json({"error": str(e)}, status=e.status)
+            if self.verifier is not None:
+                try:
+                    with metrics.time("verify"):
+                        await self.verifier.verify(
+                            request.headers, request.body, alexa_request)
+                except AlexaRequestError as e:
+                    metrics.inc("unverified")
+                    logger.warning("Unverified Alexa request: %s", e)
+                    return response.json({"error": str(e)}, status=e.status)
+            agent = getattr(request.app, "agent", None)
+            if self.bypass_nlu:
+                install_echo_interpreter(agent, self.launch_intent)
+            store = install_snapshot_tracker_store(agent) \
+                if self.state_codec is not None else None
+            if self.identities is not None:
+                await identify(alexa_request, agent)
+            sender_id = await self._extract_sender(alexa_request)
+            req = alexa_request.request
+            logger.debug("Received %s from sender %s",
+                         alexa_request.request_type, sender_id)
             should_use_stream = rasa.utils.endpoints.bool_arg(
                 request, "stream", default=False
             )
+            # Lifecycle events without a dedicated handler are
+            # acknowledged without touching the tracker.
+            handler = request_handlers.get(alexa_request.request_type,
+                                           acknowledge)
 
-            if should_use_stream:
+            if should_use_stream and handler is not acknowledge:
+                # a streamed turn keeps its state in the tracker store
+                metrics.inc("streamed")
+                parse_data = launch_parse_data(alexa_request) \
+                    if handler is launch else None
                 return response.stream(
-                    self.stream_response(on_new_message, req, sender_id),
+                    self.stream_response(on_new_message, alexa_request,
+                                         parse_data, received_at),
                     content_type="text/event-stream",
                 )
             else:
-                collector = CollectingOutputChannel()
-                # noinspection PyBroadException
-                try:
-                    await on_new_message(
-                        UserMessage(
-                            json.dumps(req), collector, sender_id,
-                            input_channel=self.name()
-                        )
-                    )
-                except CancelledError:
-                    logger.error(
-                        "Message handling timed out for "
-                        "user message '{}'.".format(req)
-                    )
-                except Exception:
-                    logger.exception(
-                        "An exception occured while handling "
-                        "user message '{}'.".format(req)
-                    )
-                # return response.json(collector.messages)
-                return response.json(mapp2Echo(collector.messages))
-
-        def mapp2Echo(messages):
-            print("message:")
-            print(messages)
-            print("messages[0]")
-            print(messages[0])
-            msg = getJsonObject(messages[0])
-            answer = msg.get("text")
-            print("answer: " + answer)
+                budget = remaining_budget(req.get("timestamp"),
+                                          self.turn_deadline, received_at)
+                budget -= time.time() - received_at
+                return await handler(alexa_request, budget, store)
+
+        async def identify(alexa_request, agent):
+            # Replaces the userId of the request by its sender id. Trackers
+            # of senders new to this instance are migrated from the userId,
+            # on the executor as tracker stores block.
+            user_id = alexa_request.sender_id
+            sender_id, new = self.identities.identify(user_id)
+            alexa_request.sender_id = sender_id
+            if not new:
+                return
+            logger.debug("Sender %s is Alexa user %s", sender_id, user_id)
+            tracker_store = getattr(agent, "tracker_store", None)
+            if self.migrate_senders and tracker_store is not None and \
+                    await asyncio.get_event_loop().run_in_executor(
+                        None, migrate_tracker, tracker_store, user_id,
+                        sender_id):
+                metrics.inc("senders_migrated")
+                logger.info("Migrated the tracker of sender %s.", sender_id)
+
+        def launch_parse_data(alexa_request):
+            # Alexa did the intent recognition, there is nothing left to do
+            # for the NLU pipeline.
             return {
-                "version": "0.1",
-                "sessionAttributes": {
-                    "status": "test"
-                },
-                "response": {
-                    "outputSpeech": {
-                        "type": "PlainText",
-                        "text": answer,
-                        "playBehavior": "REPLACE_ENQUEUED"
-                    },
-                    "reprompt": {
-                        "outputSpeech": {
-                            "type": "PlainText",
-                            "text": answer,
-                            "playBehavior": "REPLACE_ENQUEUED"
-                        }
-                    },
-                    "shouldEndSession": "false"
-                }
+                "text": alexa_request.request_type,
+                "intent": {"name": self.launch_intent, "confidence": 1.0},
+                "intent_ranking": [],
+                "entities": []
             }
 
+        async def launch(alexa_request, budget, store=None):
+            return await respond(alexa_request, budget, store,
+                                 launch_parse_data(alexa_request))
+
+        async def acknowledge(alexa_request, budget, store=None):
+            metrics.inc("acknowledged")
+            if alexa_request.request_type == "SessionEndedRequest":
+                logger.debug("Session of sender %s ended: %s",
+                             alexa_request.sender_id,
+                             alexa_request.request.get("reason"))
+            else:
+                logger.debug("Acknowledged %s of sender %s",
+                             alexa_request.request_type,
+                             alexa_request.sender_id)
+            return alexa_response(self.acknowledgement)
+
+        async def respond(alexa_request, budget, store=None,
+                          parse_data=None):
+            # Alexa retries requests with the same requestId. A retry gets
+            # the response of the first request or waits for its turn.
+            request_id = alexa_request.request_id
+            cached = self.responses.get(request_id) \
+                if request_id is not None else None
+            if isinstance(cached, bytes):
+                return alexa_response(cached)
+            if cached is not None:
+                turn = {"stage": "retry"}
+                task = cached
+            else:
+                turn = {"stage": "queue"}
+                task = asyncio.ensure_future(handle_turn(
+                    alexa_request, turn, store, parse_data))
+                if request_id is not None:
+                    self.responses.put(request_id, task)
+                    task.add_done_callback(
+                        lambda t: cache_response(request_id, t))
+
+            # The turn is not cancelled when running out of time, it keeps
+            # the sender lock and completes in the background.
+            await asyncio.wait([asyncio.shield(task)],
+                               timeout=max(budget, 0))
+            if not task.done():
+                # the state of the turn does not reach the sessionAttributes
+                turn["timed_out"] = True
+                metrics.inc("fallback")
+                metrics.inc("fallback_" + turn["stage"])
+                logger.warning(
+                    "Turn of sender %s ran out of time in stage %s.",
+                    alexa_request.sender_id, turn["stage"])
+                return alexa_response(self.timeout_response)
+            body = task.result()
+            if body is None:
+                return alexa_response(self.busy_response)
+            return alexa_response(body)
+
+        def cache_response(request_id, task):
+            if task.cancelled() or task.exception() is not None or \
+                    task.result() is None:
+                # failed and shed turns may be retried
+                self.responses.discard(request_id)
+            else:
+                self.responses.put(request_id, task.result())
+
+        async def handle_turn(alexa_request, turn, store=None,
+                              parse_data=None) -> Optional[bytes]:
+            # Runs a turn and returns the rendered response body or None if
+            # the turn has been shed.
+            req = alexa_request.request
+            sender_id = alexa_request.sender_id
+            collector = CollectingOutputChannel()
+            key = register_echo_request(req)
+            attributes = None
+            # noinspection PyBroadException
+            try:
+                async with self.turns.turn(sender_id):
+                    turn["stage"] = "core"
+                    if store is not None:
+                        restore_state(alexa_request, store)
+                    with metrics.time("core"):
+                        await on_new_message(
+                            UserMessage(
+                                key, collector, sender_id,
+                                parse_data=parse_data,
+                                input_channel=self.name(),
+                                message_id=key
+                            )
+                        )
+            except TurnLimitExceeded as e:
+                metrics.inc("shed")
+                logger.warning("Shedding Alexa request: %s", e)
+                return None
+            except CancelledError:
+                metrics.inc("errors")
+                logger.error(
+                    "Message handling timed out for "
+                    "user message '%s'.", req
+                )
+            except Exception:
+                metrics.inc("errors")
+                logger.exception(
+                    "An exception occured while handling "
+                    "user message '%s'.", req
+                )
+            finally:
+                release_echo_request(key)
+                if store is not None and turn["stage"] != "queue":
+                    attributes = release_state(sender_id, turn, store)
+
+            if not collector.messages:
+                metrics.inc("fallback")
+                metrics.inc("fallback_empty")
+                if attributes is not None:
+                    return mapp2Echo([{"text": self.timeout_message}],
+                                     attributes)
+                return self.timeout_response
+            # return response.json(collector.messages)
+            with metrics.time("render"):
+                return mapp2Echo(collector.messages, attributes)
+
+        def restore_state(alexa_request, store):
+            # Restores the tracker of the snapshot in the sessionAttributes.
+            # Without a snapshot a new session starts with a new tracker,
+            # others continue with the tracker of the tracker store.
+            session = alexa_request.session
+            token = (session.get("attributes") or {}).get(STATE_ATTRIBUTE)
+            events = self.state_codec.decode(token) \
+                if token is not None else None
+            if events is not None:
+                store.restore(alexa_request.sender_id, events)
+            elif token is not None:
+                metrics.inc("state_invalid")
+                logger.warning("Ignoring invalid state of sender %s",
+                               alexa_request.sender_id)
+            elif session.get("new"):
+                store.restore(alexa_request.sender_id)
+
+        def release_state(sender_id, turn, store):
+            # Returns the sessionAttributes carrying the state of the turn.
+            tracker = store.release(sender_id)
+            stored = tracker is None
+            if stored:
+                tracker = store.retrieve(sender_id)
+            token = self.state_codec.encode(tracker) \
+                if tracker is not None and not turn.get("timed_out") \
+                else None
+            if token is None:
+                # the tracker store takes over until the next snapshot
+                metrics.inc("state_stored")
+                if not stored:
+                    store.store.save(tracker)
+                return None
+            return {STATE_ATTRIBUTE: token}
+
+        def mapp2Echo(messages, session_attributes=None) -> bytes:
+            logger.debug("Bot messages: %s", messages)
+            return self.renderer.render(
+                messages, session_attributes=session_attributes)
+
+        def alexa_response(body):
+            return response.raw(body, content_type="application/json")
+
+        request_handlers = {
+            "IntentRequest": respond,
+            "LaunchRequest": launch,
+            "SessionEndedRequest": acknowledge,
+        }
+
         return custom_webhook
 
 
 class EchoNLUMapper(Component):
-    """Mapping echo json to Rasa intents and entities"""
+    """Mapping echo json to Rasa intents and entities
+
+    The index used for the mapping is built from the Alexa interaction
+    model exported by genEchoDefinition (skill_model) during training and
+    persisted with the Rasa model. It maps
+        - Alexa intents to Rasa intents (intent_mapping overrides),
+        - slots to their entities (slot_mapping overrides) and types,
+        - slot type synonyms to their canonical values."""
 
     name = "EchoNLUMapper"
     provides = ["entities"]
     requires = []
-    defaults = {}
+    defaults = {
+        # Alexa interaction model, i.e. echoSkillConfiguration.json
+        "skill_model": None,
+        "intent_mapping": {
+            "AMAZON.StopIntent": "stop",
+            "AMAZON.CancelIntent": "stop",
+            "AMAZON.YesIntent": "affirm",
+            "AMAZON.NoIntent": "deny",
+        },
+        # slot name -> entity name, for slots named unlike their entity
+        "slot_mapping": {},
+        # intent of a LaunchRequest, overridden by the EchoConnector
+        "launch_intent": DEFAULT_LAUNCH_INTENT,
+    }
     language_list = ["en"]
 
-    def __init__(self, component_config=None):
-        print("initialize, __init__")
+    def __init__(self, component_config=None, index=None):
         super(EchoNLUMapper, self).__init__(component_config)
-        print("init of super called")
+        self._set_index(index or {})
+
+    def _set_index(self, index):
+        self.index = index
+        self.intents = dict(index.get("intents", {}))
+        self.intents.update(self.component_config["intent_mapping"])
+        self.slot_entities = dict(index.get("slot_entities", {}))
+        self.slot_entities.update(self.component_config["slot_mapping"])
+        self.slot_types = index.get("slot_types", {})
+        self.synonyms = index.get("synonyms", {})
+
+    @staticmethod
+    def build_index(skill_model_file):
+        """Builds the mapping index of an exported Alexa interaction model."""
+
+        model = rasa.utils.io.read_json_file(skill_model_file)
+        languageModel = model["interactionModel"]["languageModel"]
+        intents = {}
+        slot_entities = {}
+        slot_types = {}
+        for intent in languageModel["intents"]:
+            intents[intent["name"]] = intent["name"]
+            for slot in intent.get("slots", []):
+                # genEchoDefinition names the slots after their entities
+                slot_entities[slot["name"]] = slot["name"]
+                slot_types[slot["name"]] = slot["type"]
+        synonyms = {}
+        for type_ in languageModel["types"]:
+            values = synonyms.setdefault(type_["name"], {})
+            for value in type_["values"]:
+                name = value["name"]
+                values[name["value"].lower()] = name["value"]
+                for synonym in name.get("synonyms", []):
+                    values[synonym.lower()] = name["value"]
+        return {"intents": intents,
+                "slot_entities": slot_entities,
+                "slot_types": slot_types,
+                "synonyms": synonyms}
 
     def train(self, training_data, cfg, **kwargs):
-        """Not needed, because the the model will be trained on echo side"""
-        pass
+        """The model is trained on echo side. Only the index of the exported
+        interaction model is built."""
+
+        skill_model = self.component_config["skill_model"]
+        if skill_model is not None:
+            self._set_index(self.build_index(skill_model))
 
     def convert_to_rasa(self, value, confidence):
         """Convert model output into the Rasa NLU compatible output format."""
-        print("convert_to_rasa")
         entity = {"value": value,
                   "confidence": confidence,
                   "entity": "echonlu",
@@ -210,17 +1521,42 @@ class EchoNLUMapper(Component):
 
         return entity
 
+    @staticmethod
+    def alexa_resolution(slotVal):
+        # The value of the first entity resolution matched by Alexa.
+        resolutions = slotVal.get("resolutions") or {}
+        for authority in resolutions.get("resolutionsPerAuthority", []):
+            values = authority.get("values")
+            if values and authority.get("status", {}).get(
+                    "code") == "ER_SUCCESS_MATCH":
+                return values[0]["value"]["name"]
+        return None
+
+    def resolve_value(self, slotKey, slotVal):
+        # Prefers the entity resolution done by Alexa, then the synonyms of
+        # the slot type. Unfilled slots have no value at all.
+        value = slotVal.get("value")
+        if value is None:
+            return None
+        resolved = self.alexa_resolution(slotVal)
+        if resolved is not None:
+            return resolved
+        synonyms = self.synonyms.get(self.slot_types.get(slotKey))
+        if synonyms:
+            return synonyms.get(value.lower(), value)
+        return value
+
     def extractEntities(self, slots):
-        # for slotKey, slotVal in slots.items():
-        #     print(slotKey)
-        #     value = slotVal.get("value", None)
-        #     print(value)
-        print("extractEntities")
-        return [{"value": slotVal.get("value", None),
-                 "confidence": 1.0,
-                 "entity": slotKey,
-                 "extractor": "echo2rasa"}
-                for slotKey, slotVal in slots.items()]
+        entities = []
+        for slotKey, slotVal in slots.items():
+            value = self.resolve_value(slotKey, slotVal)
+            if value is not None:
+                entities.append({
+                    "value": value,
+                    "confidence": 1.0,
+                    "entity": self.slot_entities.get(slotKey, slotKey),
+                    "extractor": "echo2rasa"})
+        return entities
 
     def process(self, message, **kwargs):
         """Retrieve the text message, pass it to the classifier
@@ -231,27 +1567,40 @@ class EchoNLUMapper(Component):
         # key, value = max(res.items(), key=lambda x: x[1])
 
         # entity = self.convert_to_rasa(key, value)
-        print("EchoNLUMapper performing mapping")
-        print("message:" + message.text)
-        msg = json.loads(message.text)
+        with metrics.time("nlu"):
+            self._map(message)
+
+    def _map(self, message):
+        req = lookup_echo_request(message.text)
+        if req is None:
+            logger.debug("No Alexa request within message %s",
+                         message.text)
+            return
+        intentName, entities = self.map_request(req)
+        if entities:
+            message.set("entities", entities, add_to_output=True)
+        message.set("intent", {"name": intentName,
+                               "confidence": 1.0}, add_to_output=True)
+
+    def map_request(self, msg, launch_intent=None):
+        """Returns the intent name and the entities of an Alexa request."""
+
+        entities = []
         msgType = msg.get("type")
         if (msgType == "LaunchRequest"):
-            intentName = "greet"
+            intentName = launch_intent or \
+                self.component_config["launch_intent"]
         else:
-            intent = getJsonObject(msg.get("intent"))
-            intentName = intent.get("name")
-            slots = getJsonObject(intent.get("slots"))
-            print("slots:")
-            print(slots)
+            intent = msg.get("intent") or {}
+            intentName = self.intents.get(intent.get("name"),
+                                          intent.get("name"))
+            slots = intent.get("slots")
             if (slots is not None):
                 entities = self.extractEntities(slots)
-                print("entities")
-                print(entities)
-                message.set("entities", entities, add_to_output=True)
+                logger.debug("Extracted entities: %s", entities)
 
-        print("intentName: ", intentName)
-        message.set("intent", {"name": intentName,
-                               "confidence": 1.0}, add_to_output=True)
+        logger.debug("Mapped %s to intent %s", msgType, intentName)
+        return intentName, entities
 
         # return {
         #     "text": message_text,
@@ -260,7 +1609,20 @@ class EchoNLUMapper(Component):
         #     "entities": entities,
         # }
 
-    def persist(self, model_dir, model_name):
-        """Pass because a pre-trained model is already persisted"""
+    def persist(self, file_name, model_dir):
+        """Persist the mapping index, the model itself lives on echo side."""
+
+        if not self.index:
+            return {"file": None}
+        file_name = file_name + ".json"
+        write_json_to_file(os.path.join(model_dir, file_name), self.index)
+        return {"file": file_name}
 
-        pass
+    @classmethod
+    def load(cls, meta, model_dir=None, model_metadata=None,
+             cached_component=None, **kwargs):
+        file_name = meta.get("file")
+        if not file_name:
+            return cls(meta)
+        return cls(meta, rasa.utils.io.read_json_file(
+            os.path.join(model_dir, file_name)))
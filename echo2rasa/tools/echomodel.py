@@ -18,14 +18,218 @@
 """
 
 import re
+import os
 import json
+import hashlib
+import logging
+import tempfile
 import yaml
 
+logger = logging.getLogger(__name__)
+
+# limits of the Alexa interaction model
+ALEXA_MAX_SLOT_VALUES = 50000   # values and synonyms of all custom types
+ALEXA_MAX_VALUE_LENGTH = 140    # characters of a value or synonym
+# Samples held in memory before they are spooled to temporary files, one
+# per intent, so an export needs the memory of its largest intent only.
+MAX_HELD_SAMPLES = 50000
+
 # regular expression class variables used to parse configurations
-re_entities_and_values = re.compile(r"(\[[^\[]*\][^\[]*\([^\[\(]*\))")
-re_value = re.compile(r"(\[.*\])")
-re_entity = re.compile(r"(\(.*\))")
 re_is_key_value_pair = re.compile(r':.+')
+# [value](entity) or [alias](entity:value) annotation within an utterance
+re_annotation = re.compile(r"\[([^\]]*)\]\(([^)]*)\)")
+# characters removed from utterances: "?", "!", "," and digits
+re_removed_chars = re.compile(r"[?!,\d]")
+# entity annotations of an utterance, example values and entity names
+re_utterance_entity = re.compile(r"\[.*?\]|\((.*?)\)")
+
+
+def parse_utterance(utterance):
+    # Format an utterance for Alexa/Echo and return the slots used by it.
+    # Removes question marks, commas, exclamation marks, numbers (digits)
+    # and sample values.
+
+    # Example:
+    #   utterance: [indonesian](cuisine) food for [3](num_people:3)
+    #   returns: ['{cuisine}', '{num_people}'], {cuisine} food for {num_people}
+    slots = []
+
+    def format_entity(matchobj):
+        # Remove any example or entity value and replace parantheses
+        # with braces.
+        entity = matchobj.group(1)
+        if entity is None:
+            return ''
+        slot = "{" + entity.partition(':')[0] + "}"
+        slots.append(slot)
+        return slot
+
+    utterance = re_removed_chars.sub('', utterance)
+    return slots, re_utterance_entity.sub(format_entity, utterance)
+
+
+def iter_sections(reader):
+    # Yields the "##" header and the non empty lines of every section of a
+    # nlu.md file. Lines in front of the first header have no header.
+    header = None
+    lines = []
+    for line in reader:
+        line = line.strip()
+        if line.startswith('##'):
+            if header is not None or len(lines) > 0:
+                yield header, lines
+            header = line
+            lines = []
+        elif line != '':
+            lines.append(line)
+    if header is not None or len(lines) > 0:
+        yield header, lines
+
+
+def parse_section(header, lines):
+    # Returns the samples and slots of an intent section, the entries and
+    # referenced files of lookup and synonym sections and the entity
+    # annotations of any section.
+    isIntent = header is not None and header.startswith('## intent:')
+    samples = []
+    slots = {}
+    annotations = []
+    entries = []
+    files = []
+    for line in lines:
+        if '[' in line:
+            annotations.extend(re_annotation.findall(line))
+        if isIntent and line.startswith('-'):
+            lineSlots, utterance = parse_utterance(line[1:].strip())
+            samples.append(utterance)
+            for slot in lineSlots:
+                slots[slot] = None
+        elif line.startswith('-'):
+            entries.append(line[1:].strip())
+        else:
+            files.append(line)
+    return {"samples": samples,
+            "slots": list(slots),
+            "annotations": annotations,
+            "entries": entries,
+            "files": files}
+
+
+def iter_lookup_file(fileName):
+    # Streams a lookup file with one value per line. Synonyms of a value
+    # may follow it, separated by tabs. Empty lines and lines starting
+    # with "#" are skipped.
+    with open(fileName, 'r') as reader:
+        for line in reader:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            value, *synonyms = [part.strip() for part in line.split('\t')]
+            yield value, [synonym for synonym in synonyms if synonym != '']
+
+
+def unique_samples(samples):
+    # Yields the samples with normalized whitespace, leaving out empty ones
+    # and duplicates, which are rejected by Alexa. Only a short digest of
+    # every sample is remembered.
+    seen = set()
+    for sample in samples:
+        sample = " ".join(sample.split())
+        if sample == '':
+            continue
+        digest = hashlib.blake2b(
+            sample.lower().encode("utf-8"), digest_size=8).digest()
+        if digest not in seen:
+            seen.add(digest)
+            yield sample
+
+
+def file_hash(fileName):
+    sha = hashlib.sha1()
+    with open(fileName, 'rb') as reader:
+        for chunk in iter(lambda: reader.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# Version of the cached parse results, to be raised whenever parse_section
+# or the domain file parsers change what they return.
+CACHE_FORMAT = 2
+
+
+class ExportCache(object):
+    """ Parsed input of former exports, keyed by content hashes.
+
+    Keeps the parsed domain files and every parsed nlu.md section, so an
+    export only has to parse what changed since. Sections not seen by the
+    latest export are dropped. The cache may be persisted to cacheFile,
+    a persisted cache of another CACHE_FORMAT is discarded.
+    """
+
+    def __init__(self, cacheFile=None):
+        self.cacheFile = cacheFile
+        self.files = {}     # input file role -> content hash
+        self.parsed = {}    # content hash -> parsed domain file
+        self.sections = {}  # content hash -> parsed nlu.md section
+        self._seen = {}
+        if cacheFile is not None and os.path.exists(cacheFile):
+            with open(cacheFile, 'r') as reader:
+                cache = json.load(reader)
+            if cache.get("format") != CACHE_FORMAT:
+                return
+            self.files = cache["files"]
+            self.parsed = cache["parsed"]
+            self.sections = cache["sections"]
+
+    def section(self, header, lines):
+        key = hashlib.sha1(
+            "\n".join([header or ''] + lines).encode("utf-8")).hexdigest()
+        section = self.sections.get(key)
+        if section is None:
+            section = parse_section(header, lines)
+        self._seen[key] = section
+        return section
+
+    def domain(self, fileName, parse):
+        key = file_hash(fileName)
+        parsed = self.parsed.get(key)
+        if parsed is None:
+            parsed = self.parsed[key] = parse(fileName)
+        return parsed
+
+    @staticmethod
+    def hash_files(files):
+        # files: file role -> file name
+        return {role: file_hash(fileName)
+                for role, fileName in files.items()}
+
+    def commit(self):
+        # Keeps only the sections and domain files of the latest export.
+        self.sections = self._seen
+        self._seen = {}
+        self.parsed = {key: parsed for key, parsed in self.parsed.items()
+                       if key in self.files.values()}
+        if self.cacheFile is not None:
+            with open(self.cacheFile, 'w') as writer:
+                json.dump({"format": CACHE_FORMAT,
+                           "files": self.files,
+                           "parsed": self.parsed,
+                           "sections": self.sections}, writer)
+
+
+def read_domain_intents(fileName):
+    # Returns the intent names of the intents section of a domain file.
+    with open(fileName, 'r') as stream:
+        yml = yaml.safe_load(stream)
+    return [next(iter(intent)) if isinstance(intent, dict) else intent
+            for intent in yml['intents']]
+
+
+def read_echo_slots(fileName):
+    # Returns the slot types of an echo_domain.yml file.
+    with open(fileName, 'r') as stream:
+        yml = yaml.safe_load(stream)
+    return {name: typeDir['type'] for name, typeDir in yml['slots'].items()}
 
 
 class EchoModel(object):
@@ -33,13 +237,22 @@ class EchoModel(object):
     def __init__(
             self, name,
             rasa_domain_file, rasa_nlu_file,
-            echo_domain_file):
+            echo_domain_file, cache=None, lookup_files=None):
         self._rasa_domain_file = rasa_domain_file
         self._rasa_nlu_file = rasa_nlu_file
         self._echo_domain_file = echo_domain_file
+        self._cache = cache      # ExportCache for incremental exports
+        # Lookup files as (entity name, file name), in addition to the
+        # ones referenced by the lookup sections of the nlu file
+        self._lookup_files = list(lookup_files or [])
+        self._synonyms = {}      # Values and their synonyms of all entities
         self._intent_dir = {}    # Intents with their names and samples
         self._slots_dir = {}     # Slots with their names and types
         self._entitiy_types = {}  # Entity types and their values
+        self._entity_values = {}  # Entities and their annotated values
+        self._max_samples = MAX_HELD_SAMPLES
+        self._held_samples = 0
+        self._spool_dir = None   # temporary directory of spooled samples
         self.model = {
             "interactionModel": {
                 "languageModel": {
@@ -54,20 +267,18 @@ class EchoModel(object):
         # Parse intents section of yaml file.
         # Every intent will be put into json representation
         # and added to the model.
-        with open(self._rasa_domain_file, 'r') as stream:
-            yml = yaml.safe_load(stream)
-            intents = yml['intents']
-            for intent in intents:
-                if isinstance(intent, dict):
-                    intentName = next(iter(intent))
-                else:
-                    intentName = intent
-                self._intent_dir[intentName] = {
-                    "name": intentName,
-                    "samples": []
-                }
-                self.model['interactionModel']['languageModel']['intents']\
-                    .append(self._intent_dir[intentName])
+        if self._cache is not None:
+            intents = self._cache.domain(
+                self._rasa_domain_file, read_domain_intents)
+        else:
+            intents = read_domain_intents(self._rasa_domain_file)
+        for intentName in intents:
+            self._intent_dir[intentName] = {
+                "name": intentName,
+                "samples": []
+            }
+            self.model['interactionModel']['languageModel']['intents']\
+                .append(self._intent_dir[intentName])
 
     def _update_intent_slotlist(self):
 
@@ -80,122 +291,159 @@ class EchoModel(object):
         for intent in \
                 self.model['interactionModel']['languageModel']['intents']:
             if ('slots' in intent):
-                intentSlots = genSlots(list(set(intent['slots'])))
+                intentSlots = genSlots(intent['slots'])
                 intent['slots'] = intentSlots
 
     def _import_nlu_file(self):
-        # Parse the nlu.md file and add utterances to corresponding intents
-        # within our model
-        def parse_utterance(utterance):
-            # Remove quotation marks, commas and exclamation marks.
-            # Remove sample values.
-            # Remove numbers (digits)
-            # Format for Alexa/Echo.
-            def format_entities(matchobj):
-                # Remove any entity value and replace parantheses with braces.
-
-                # Example:
-                #   matchobj: (entity:3)
-                #   returns: {entity}
-
-                entity_without_paranthesis = matchobj.group(0)[1:-1]
-                idxOfCol = entity_without_paranthesis.find(':')
-                if (idxOfCol >= 0):
-                    entity_without_paranthesis = \
-                        entity_without_paranthesis[0:idxOfCol]
-                return "{"+entity_without_paranthesis+"}"
-
-            # Remove "!". "," , "?" and digits.
-            utterance = re.sub(r"(\?)", '', utterance)
-            utterance = re.sub(r"(!)", '', utterance)
-            utterance = re.sub(r"(,)", '', utterance)
-            utterance = re.sub(r"(\d)", '', utterance)
-            result = re.sub(r"(\(.*?\))", format_entities, utterance)
-
-            # Remove example values
-            # (i.e. replace [indonesian]{cuisine} by {cuisine})
-            result = re.sub(r"(\[.*?\])", '', result)
-            slots = re.findall(r"(\{.*?\})", result)
-            return slots, result
-
+        # Parse the nlu.md file in a single pass, section by section.
+        # Utterances are added to their intents within our model, the slots
+        # used by an intent and the annotated entity values (of every
+        # section) are collected. Unchanged sections are taken from the
+        # cache of an incremental export.
         with open(self._rasa_nlu_file, 'r') as reader:
-            line = reader.readline().strip()
-            while line != '':  # The EOF char is an empty string
-                # print(line, end='')
-                if line.startswith('## intent:'):
-                    # read utterances
-                    intentName = line[10:]
-                    intentSlots = []
-                    line = reader.readline().strip()
-                    while line.startswith('-'):
-                        utterance = line[1:].strip()
-                        # print('before:' + utterance)
-                        slots, utterance = parse_utterance(utterance)
-                        # print('after:' + utterance)
-                        self._intent_dir[intentName]['samples'].append(
-                            utterance)
-                        if (len(slots) > 0):
-                            intentSlots.extend(slots)
-                        line = reader.readline().strip()
-                    if (len(intentSlots) > 0):
-                        self._intent_dir[intentName]['slots'] = intentSlots
-                line = reader.readline().strip()
+            for header, lines in iter_sections(reader):
+                if self._cache is not None:
+                    section = self._cache.section(header, lines)
+                else:
+                    section = parse_section(header, lines)
+                for alias, entity in section["annotations"]:
+                    self._add_entity_value(entity, alias)
+                if header is None:
+                    continue
+                if header.startswith('## lookup:'):
+                    entityName = header[10:]
+                    for value in section.get("entries", []):
+                        self._add_value(entityName, value)
+                    for fileName in section.get("files", []):
+                        self._lookup_files.append(
+                            (entityName,
+                             self._find_lookup_file(entityName, fileName)))
+                elif header.startswith('## synonym:'):
+                    self._synonyms.setdefault(header[11:], set()).update(
+                        section.get("entries", []))
+                elif header.startswith('## intent:'):
+                    intent = self._intent_dir[header[10:]]
+                    self._add_samples(intent, section["samples"])
+                    if len(section["slots"]) > 0:
+                        slots = dict.fromkeys(intent.get('slots', []))
+                        slots.update(dict.fromkeys(section["slots"]))
+                        intent['slots'] = list(slots)
+
+    def _find_lookup_file(self, entityName, fileName):
+        # Rasa opens the files of lookup sections relative to the working
+        # directory, files next to the nlu file are found as well.
+        nluFile = os.path.join(os.path.dirname(self._rasa_nlu_file), fileName)
+        for candidate in (nluFile, fileName):
+            if os.path.exists(candidate):
+                return candidate
+        raise FileNotFoundError(
+            f'File {fileName} of section ## lookup:{entityName} is neither '
+            f'next to {self._rasa_nlu_file} nor in the working directory')
+
+    def _add_samples(self, intent, samples):
+        intent['samples'].extend(samples)
+        self._held_samples += len(samples)
+        if self._held_samples > self._max_samples:
+            self._spool_samples()
+
+    def _spool_file(self, intent):
+        return os.path.join(self._spool_dir.name,
+                            hashlib.sha1(intent['name'].encode("utf-8"))
+                            .hexdigest())
+
+    def _spool_samples(self):
+        # Appends the samples held in memory to the spool files of their
+        # intents.
+        if self._spool_dir is None:
+            self._spool_dir = tempfile.TemporaryDirectory(prefix="echomodel")
+        for intent in self._intent_dir.values():
+            if len(intent['samples']) == 0:
+                continue
+            with open(self._spool_file(intent), 'a',
+                      encoding="utf-8") as writer:
+                for sample in intent['samples']:
+                    writer.write(sample + '\n')
+            intent['samples'] = []
+        self._held_samples = 0
+
+    def _iter_samples(self, intent):
+        # Yields the spooled samples of an intent and the ones in memory.
+        if self._spool_dir is not None and \
+                os.path.exists(self._spool_file(intent)):
+            with open(self._spool_file(intent), 'r',
+                      encoding="utf-8") as reader:
+                for line in reader:
+                    yield line[:-1]
+        yield from intent['samples']
+
+    def _add_entity_value(self, entity, alias):
+        # i.e. [pan asian](cuisine:asian) or [italian](cuisine)
+        entityName, _, entityValue = entity.partition(':')
+        if entityValue == '':
+            self._add_value(entityName, alias)
+        else:
+            self._add_value(entityName, entityValue, (alias,))
+
+    def _add_value(self, entityName, value, aliases=()):
+        # Values are kept once per entity, their aliases in a set.
+        entityValues = self._entity_values.setdefault(entityName, {})
+        entityValues.setdefault(value, set()).update(aliases)
+
+    def _import_lookup_files(self):
+        # Stream the values and synonyms of the lookup files into the
+        # values of their entities.
+        for entityName, fileName in self._lookup_files:
+            for value, synonyms in iter_lookup_file(fileName):
+                self._add_value(entityName, value, synonyms)
+
+    def _check_type_limits(self):
+        count = 0
+        for type, typeValues in self._entitiy_types.items():
+            if type.startswith("AMAZON"):
+                continue
+            for value, aliases in typeValues.items():
+                count += 1 + len(aliases)
+                for name in [value] + list(aliases):
+                    if len(name) > ALEXA_MAX_VALUE_LENGTH:
+                        logger.warning(
+                            f'Value "{name[:40]}..." of slot type {type} '
+                            f'exceeds {ALEXA_MAX_VALUE_LENGTH} characters')
+        if count > ALEXA_MAX_SLOT_VALUES:
+            logger.warning(
+                f'{count} slot values and synonyms exceed the limit of '
+                f'{ALEXA_MAX_SLOT_VALUES} of an Alexa interaction model')
 
     def _import_entity_definitions(self):
-        def update_entity(name, value, alias):
-            entityName = self._slots_dir[name]["type"]
-            entityEntry = self._entitiy_types.get(
-                entityName, {value: []})
-            entityValues = entityEntry.get(value, [])
-            if (alias is not None):
-                entityValues.append(alias)
-            entityEntry[value] = list(set(entityValues))
-            self._entitiy_types[entityName] = entityEntry
-
-        entityAndValueList = []
-        with open(self._rasa_nlu_file, 'r') as reader:
-            for line in reader:
-                entityAndValueList.extend(re_entities_and_values.findall(line))
-
-        for entityAndValue in entityAndValueList:
-            entityName = None
-            entityValue = None
-
-            entityEntry = {}
-            hasAlias = False
-
-            entityGroup = re_entity.search(entityAndValue)
-            # i.e. [pan asian](cuisine:asian)
-            if (entityGroup is not None):
-                entityName = entityGroup[0][1: -1]  # i.e. cuisine:asian
-                if (entityName.find(":") > 0):
-                    entityName, entityValue = entityName.split(
-                        ":")  # cuisine, asian
-                    hasAlias = True
-
-                valueGroup = re_value.search(entityAndValue)
-                if (valueGroup is not None):
-                    alias = valueGroup[0][1: -1]
-                    if (hasAlias):
-                        update_entity(entityName, entityValue, alias)
-                    else:
-                        update_entity(entityName, alias, None)
+        # Merge the collected entity values and the synonyms of the
+        # synonym sections into their slot types and add these types to
+        # the model.
+        self._import_lookup_files()
+        for entityName, entityValues in self._entity_values.items():
+            if entityName not in self._slots_dir:
+                logger.warning(
+                    f'Skipping values of entity {entityName} which is no '
+                    f'slot of the echo domain')
+                continue
+            entityType = self._slots_dir[entityName]["type"]
+            typeValues = self._entitiy_types.setdefault(entityType, {})
+            for value, aliases in entityValues.items():
+                typeValues.setdefault(value, set()).update(aliases)
+                typeValues[value].update(self._synonyms.get(value, ()))
+        self._check_type_limits()
 
+        # Types and values are sorted to keep the output stable.
         types = []
-        for type, typeValues in self._entitiy_types.items():
+        for type, typeValues in sorted(self._entitiy_types.items()):
             # skip Alexa/Echo build in types
             if type.startswith("AMAZON"):
                 continue
             values = []
-            for value, aliases in typeValues.items():
-                synonyms = []
-                for alias in aliases:
-                    synonyms.append(alias)
-                if (len(synonyms) > 0):
+            for value, aliases in sorted(typeValues.items()):
+                if (len(aliases) > 0):
                     values.append({
                         "name": {
                             "value": value,
-                            "synonyms": synonyms
+                            "synonyms": sorted(aliases)
                         }
                     })
                 else:
@@ -209,19 +457,99 @@ class EchoModel(object):
         self.model['interactionModel']['languageModel']['types'] = types
 
     def _add_echo_conf(self):
-        with open(self._echo_domain_file, 'r') as stream:
-            yml = yaml.safe_load(stream)
-            slots = yml['slots']
-            for name, typeDir in slots.items():
-                self._slots_dir[name] = {'name': name, 'type': typeDir['type']}
+        if self._cache is not None:
+            slots = self._cache.domain(
+                self._echo_domain_file, read_echo_slots)
+        else:
+            slots = read_echo_slots(self._echo_domain_file)
+        for name, type in slots.items():
+            self._slots_dir[name] = {'name': name, 'type': type}
+
+    def _write_intent(self, writer, intent):
+        # Streams the samples of an intent, removing duplicates on the way.
+        writer.write('{"name": ' + json.dumps(intent['name']) +
+                     ', "samples": [')
+        for idx, sample in enumerate(
+                unique_samples(self._iter_samples(intent))):
+            if idx > 0:
+                writer.write(', ')
+            writer.write(json.dumps(sample))
+        writer.write(']')
+        for key, value in intent.items():
+            if key not in ('name', 'samples'):
+                writer.write(', ' + json.dumps(key) + ': ' +
+                             json.dumps(value))
+        writer.write('}')
+
+    def _write_model(self, outFile):
+        # Write the model intent by intent and type by type. The model is
+        # written to a temporary file first, which replaces outFile when
+        # complete.
+        languageModel = self.model['interactionModel']['languageModel']
+        fd, tmpFile = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(outFile)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as writer:
+                writer.write('{"interactionModel": {"languageModel": '
+                             '{"invocationName": ')
+                writer.write(json.dumps(languageModel['invocationName']))
+                writer.write(', "intents": [')
+                for idx, intent in enumerate(languageModel['intents']):
+                    if idx > 0:
+                        writer.write(', ')
+                    self._write_intent(writer, intent)
+                writer.write('], "types": [')
+                for idx, type in enumerate(languageModel['types']):
+                    if idx > 0:
+                        writer.write(', ')
+                    writer.write(json.dumps(type))
+                writer.write(']}}}')
+            # mkstemp creates the file readable by its owner only
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmpFile, 0o666 & ~umask)
+            os.replace(tmpFile, outFile)
+        except BaseException:
+            os.remove(tmpFile)
+            raise
+        finally:
+            if self._spool_dir is not None:
+                self._spool_dir.cleanup()
+                self._spool_dir = None
+
+    def _source_files(self, lookupFiles):
+        # Returns the files an export depends on by their role. Lookup
+        # files referenced by the nlu file are only known after an export.
+        files = {"domain": self._rasa_domain_file,
+                 "nlu": self._rasa_nlu_file,
+                 "echo_domain": self._echo_domain_file}
+        for fileName in lookupFiles:
+            if os.path.exists(fileName):
+                files["lookup:" + fileName] = fileName
+        for _, fileName in self._lookup_files:
+            files["lookup:" + fileName] = fileName
+        return files
 
     def export2echo(self, outFile):
+        # Returns False if an incremental export found nothing to do.
+        if self._cache is not None:
+            hashes = self._cache.hash_files(self._source_files(
+                role.partition(':')[2] for role in self._cache.files
+                if role.startswith("lookup:")))
+            if os.path.exists(outFile):
+                hashes["output"] = file_hash(outFile)
+                if hashes == self._cache.files:
+                    return False
         self._import_domain()
         self._import_nlu_file()
         self._add_echo_conf()
         self._update_intent_slotlist()
         self._import_entity_definitions()
-        js = json.dumps(self.model)
-        f = open(outFile, "w")
-        f.write(js)
-        f.close()
+        self._write_model(outFile)
+        if self._cache is not None:
+            hashes = self._cache.hash_files(self._source_files(
+                fileName for _, fileName in self._lookup_files))
+            hashes["output"] = file_hash(outFile)
+            self._cache.files = hashes
+            self._cache.commit()
+        return True
@@ -1,5 +1,16 @@
 import argparse
-from echomodel import EchoModel
+import os
+import sys
+import time
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from echomodel import EchoModel, ExportCache, file_hash, \
+    read_domain_intents, read_echo_slots
+
+# Domain files parsed once by the batch and handed to every worker process.
+_shared_parsed = {}
+# Keys every job of a manifest needs, given by the job or the defaults.
+JOB_KEYS = ('invocation', 'domain', 'nlu', 'echoconf', 'output')
 
 
 def readArgs():
@@ -16,13 +27,189 @@ def readArgs():
     parser.add_argument(
         "-o", "--output", help="output path to echo configuration file",
         default="echoSkillConfiguration.json")
-    return parser.parse_args()
+    parser.add_argument(
+        "-l", "--lookup", action="append", default=[],
+        metavar="ENTITY=FILE",
+        help="values of an entity, one per line with tab separated "
+             "synonyms, may be repeated")
+    parser.add_argument(
+        "-c", "--cache",
+        help="cache file of parsed input, only changes are re-parsed")
+    parser.add_argument(
+        "-w", "--watch", action="store_true",
+        help="regenerate whenever an input file changes")
+    parser.add_argument(
+        "--interval", help="seconds between checks for changes (--watch)",
+        type=float, default=0.2)
+    parser.add_argument(
+        "-b", "--batch",
+        help="manifest (yml) of export jobs to run in parallel")
+    parser.add_argument(
+        "-p", "--processes", help="worker processes of a batch",
+        type=int, default=None)
+    args = parser.parse_args()
+    args.lookup = [readLookupArg(arg) for arg in args.lookup]
+    return args
+
+
+def readLookupArg(arg):
+    entityName, sep, fileName = arg.partition('=')
+    if sep == '' or entityName == '' or fileName == '':
+        raise argparse.ArgumentTypeError(
+            f'lookup {arg} is not of the form ENTITY=FILE')
+    return entityName, fileName
+
+
+def export(args, cache):
+    start = time.perf_counter()
+    echoModel = EchoModel(args.invocation, args.domain,
+                          args.nlu, args.echoconf, cache, args.lookup)
+    if echoModel.export2echo(args.output):
+        print(f'Alexa/Echo model dumped to {args.output} '
+              f'({(time.perf_counter() - start) * 1000:.0f} ms)')
+    else:
+        print(f'Alexa/Echo model {args.output} is up to date')
+
+
+def mtime(fileName):
+    try:
+        return os.stat(fileName).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def watchedFiles(args, cache):
+    # The input files, including the lookup files referenced by the nlu
+    # file, which the cache records after every export.
+    files = [args.domain, args.nlu, args.echoconf] + \
+        [fileName for _, fileName in args.lookup]
+    for role in cache.files:
+        fileName = role.partition(':')[2]
+        if role.startswith('lookup:') and fileName not in files:
+            files.append(fileName)
+    return files
+
+
+def watch(args, cache):
+    # Polls the modification times of the input files.
+    files = []
+    mtimes = None
+    try:
+        while True:
+            current = [mtime(fileName) for fileName in files]
+            if current != mtimes:
+                mtimes = current
+                try:
+                    export(args, cache)
+                except Exception as e:
+                    # i.e. a half saved file, retried on its next save
+                    print(f'Export failed: {type(e).__name__}: {e}')
+                # the export may have found other lookup files
+                found = watchedFiles(args, cache)
+                if found != files:
+                    files = found
+                    mtimes = [mtime(fileName) for fileName in files]
+                    print(f'Watching {", ".join(files)}')
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def readManifest(manifestFile):
+    # Returns the export jobs of a manifest like
+    #   defaults:
+    #     domain: ../../domain.yml
+    #     echoconf: ../echo_domain.yml
+    #   jobs:
+    #     - invocation: rasademo
+    #       nlu: ../../data/nlu.md
+    #       output: echoSkillConfiguration.json
+    #       lookup:
+    #         cuisine: cuisines.txt
+    # Paths are relative to the manifest.
+    with open(manifestFile, 'r') as stream:
+        manifest = yaml.safe_load(stream)
+    baseDir = os.path.dirname(os.path.abspath(manifestFile))
+    defaults = manifest.get('defaults') or {}
+    jobs = []
+    for number, entry in enumerate(manifest['jobs'], 1):
+        job = dict(defaults)
+        job.update(entry)
+        missing = [key for key in JOB_KEYS if job.get(key) is None]
+        if missing:
+            raise ValueError(f'Job {number} of {manifestFile} has no '
+                             f'{", ".join(missing)}')
+        for key in ('domain', 'nlu', 'echoconf', 'output'):
+            job[key] = os.path.join(baseDir, job[key])
+        job['lookup'] = [(entityName, os.path.join(baseDir, fileName))
+                         for entityName, fileName in
+                         (job.get('lookup') or {}).items()]
+        jobs.append(job)
+    return jobs
+
+
+def initWorker(parsed):
+    _shared_parsed.update(parsed)
+
+
+def runJob(job):
+    start = time.perf_counter()
+    cache = ExportCache()
+    cache.parsed.update(_shared_parsed)
+    try:
+        echoModel = EchoModel(job['invocation'], job['domain'],
+                              job['nlu'], job['echoconf'], cache,
+                              job['lookup'])
+        echoModel.export2echo(job['output'])
+        error = None
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    return {"invocation": job.get('invocation'),
+            "output": job.get('output'),
+            "seconds": time.perf_counter() - start,
+            "error": error}
+
+
+def runBatch(manifestFile, processes=None):
+    start = time.perf_counter()
+    jobs = readManifest(manifestFile)
+    # parse every distinct domain file only once
+    parsed = {}
+    for job in jobs:
+        for key, parse in (('domain', read_domain_intents),
+                           ('echoconf', read_echo_slots)):
+            try:
+                digest = file_hash(job[key])
+                if digest not in parsed:
+                    parsed[digest] = parse(job[key])
+            except Exception:
+                # reported as error of the job by its worker
+                pass
+
+    with ProcessPoolExecutor(processes, initializer=initWorker,
+                             initargs=(parsed,)) as executor:
+        results = list(executor.map(runJob, jobs))
+
+    for result in results:
+        status = result['error'] or 'ok'
+        print(f'{result["invocation"]:20} {result["seconds"] * 1000:8.0f} ms '
+              f'{result["output"]}: {status}')
+    failed = sum(1 for result in results if result['error'] is not None)
+    print(f'{len(results)} jobs, {failed} failed, '
+          f'{sum(result["seconds"] for result in results):.2f} s job time, '
+          f'{time.perf_counter() - start:.2f} s total')
+    return failed == 0
 
 
 if __name__ == "__main__":
     args = readArgs()
-    echoModel = EchoModel(args.invocation, args.domain,
-                          args.nlu, args.echoconf)
-    echoModel.export2echo(args.output)
-    # print(echoModel)
-    print(f'Alexa/Echo model dumped to {args.output}')
+    if args.batch is not None:
+        sys.exit(0 if runBatch(args.batch, args.processes) else 1)
+    if args.cache is not None or args.watch:
+        cache = ExportCache(args.cache)
+    else:
+        cache = None
+    if args.watch:
+        watch(args, cache)
+    else:
+        export(args, cache)
@@ -0,0 +1,53 @@
+"""Copies the trackers kept by Alexa userId to the compact sender ids.
+
+Run it once with the tracker store of endpoints.yml and the sender_secret
+of credentials.yml before enabling compact_sender_ids. Trackers of senders
+the script misses are migrated by the EchoConnector on their next turn.
+
+run with
+python -m echo2rasa.tools.migrateSenderIds -d domain.yml -e endpoints.yml -c credentials.yml
+"""
+
+import argparse
+import logging
+import yaml
+from rasa.core.domain import Domain
+from rasa.core.tracker_store import TrackerStore
+from rasa.utils.endpoints import read_endpoint_config
+from echo2rasa.echoconnector import EchoConnector, SenderIdentities, \
+    migrate_tracker_store
+
+CONNECTOR = "echo2rasa.echoconnector.EchoConnector"
+
+
+def readSenderSecret(credentialsFile):
+    with open(credentialsFile, 'r') as reader:
+        credentials = yaml.safe_load(reader) or {}
+    for name, settings in credentials.items():
+        if name.endswith(EchoConnector.__name__):
+            return (settings or {}).get('sender_secret')
+    return None
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d", "--domain", help="domain definition file", default="domain.yml")
+    parser.add_argument(
+        "-e", "--endpoints", help="endpoints with the tracker store",
+        default="endpoints.yml")
+    parser.add_argument(
+        "-c", "--credentials", help=f'credentials of the {CONNECTOR}',
+        default="credentials.yml")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = readArgs()
+    trackerStore = TrackerStore.find_tracker_store(
+        Domain.load(args.domain),
+        read_endpoint_config(args.endpoints, "tracker_store"))
+    identities = SenderIdentities(readSenderSecret(args.credentials))
+    migrated = migrate_tracker_store(trackerStore, identities)
+    print(f'{migrated} trackers migrated')
@@ -0,0 +1,261 @@
+"""Replays recorded Alexa request bodies through the EchoNLUMapper.
+
+The logs hold one webhook body per line (optionally gzipped). They are read
+as a stream and mapped in batches by a pool of worker processes, without a
+Rasa server. Only a few batches are in flight at any time, so the memory
+needed does not depend on the size of the logs. The statistics of the
+intents, slots and mapping errors are merged and written as json.
+
+run with
+python -m echo2rasa.tools.replayEchoLog requests.ndjson.gz -o replay.json
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import yaml
+from rasa.nlu.training_data import Message
+from echo2rasa.echoconnector import AlexaRequestError, EchoNLUMapper, \
+    decode_alexa_request, register_echo_request, release_echo_request
+
+CONFIG = "echo2rasa/config.yml"
+DEFAULT_BATCH_SIZE = 1000
+# error samples kept per kind of error
+MAX_SAMPLES = 5
+
+# The mapper of a worker process, created by initWorker.
+_mapper = None
+
+
+def readMapperConfig(configFile, skillModel=None):
+    # The settings of the EchoNLUMapper within a Rasa pipeline config.
+    with open(configFile, 'r') as reader:
+        config = yaml.safe_load(reader) or {}
+    for component in config.get('pipeline') or []:
+        if component.get('name', '').endswith(EchoNLUMapper.name):
+            settings = dict(component)
+            break
+    else:
+        settings = {}
+    if skillModel is not None:
+        settings['skill_model'] = skillModel
+    if settings.get('skill_model') is None:
+        raise ValueError(f'No skill_model of the {EchoNLUMapper.name} '
+                         f'in {configFile}')
+    return settings
+
+
+def openLog(fileName):
+    if fileName == '-':
+        return sys.stdin.buffer
+    if fileName.endswith('.gz'):
+        return gzip.open(fileName, 'rb')
+    return open(fileName, 'rb')
+
+
+def readBatches(fileNames, batchSize):
+    # Yields (file, number of the first line, lines) of the logs.
+    for fileName in fileNames:
+        reader = openLog(fileName)
+        try:
+            batch = []
+            first = 1
+            for number, line in enumerate(reader, 1):
+                if not batch:
+                    first = number
+                batch.append(line)
+                if len(batch) >= batchSize:
+                    yield fileName, first, batch
+                    batch = []
+            if batch:
+                yield fileName, first, batch
+        finally:
+            if reader is not sys.stdin.buffer:
+                reader.close()
+
+
+class ReplayStats(object):
+    """Counts of a replay, mergeable across batches and processes."""
+
+    def __init__(self):
+        self.requests = 0
+        self.mapped = 0
+        self.request_types = Counter()
+        self.intents = Counter()
+        self.slots = {}     # entity -> Counter of filled, empty, ...
+        self.errors = Counter()
+        self.samples = {}   # kind of error -> [(file:line, message)]
+
+    def slot(self, entity):
+        return self.slots.setdefault(entity, Counter())
+
+    def error(self, kind, location, message):
+        self.errors[kind] += 1
+        samples = self.samples.setdefault(kind, [])
+        if len(samples) < MAX_SAMPLES:
+            samples.append([location, message])
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.mapped += other.mapped
+        self.request_types.update(other.request_types)
+        self.intents.update(other.intents)
+        for entity, counts in other.slots.items():
+            self.slot(entity).update(counts)
+        self.errors.update(other.errors)
+        for kind, samples in other.samples.items():
+            kept = self.samples.setdefault(kind, [])
+            kept.extend(samples[:MAX_SAMPLES - len(kept)])
+
+    def as_dict(self):
+        return {"requests": self.requests,
+                "mapped": self.mapped,
+                "request_types": dict(self.request_types.most_common()),
+                "intents": dict(self.intents.most_common()),
+                "slots": {entity: dict(counts) for entity, counts
+                          in sorted(self.slots.items())},
+                "errors": dict(self.errors.most_common()),
+                "samples": self.samples}
+
+
+def initWorker(settings):
+    global _mapper
+    _mapper = EchoNLUMapper(
+        settings, EchoNLUMapper.build_index(settings['skill_model']))
+
+
+def countSlots(mapper, slots, stats):
+    # filled slots are resolved by Alexa, by a synonym of the slot type or
+    # kept as heard if the slot type has no value for it, the way the
+    # mapper resolves them
+    for slotKey, slotVal in slots.items():
+        counts = stats.slot(mapper.slot_entities.get(slotKey, slotKey))
+        if mapper.resolve_value(slotKey, slotVal) is None:
+            counts["empty"] += 1
+            continue
+        counts["filled"] += 1
+        value = slotVal["value"]
+        synonyms = mapper.synonyms.get(mapper.slot_types.get(slotKey))
+        if mapper.alexa_resolution(slotVal) is not None:
+            counts["resolved"] += 1
+        elif synonyms and value.lower() in synonyms:
+            counts["synonym"] += 1
+        elif synonyms:
+            counts["unresolved"] += 1
+
+
+def mapLine(mapper, line, location, stats):
+    if not line.strip():
+        return
+    stats.requests += 1
+    try:
+        alexa_request = decode_alexa_request(line)
+    except AlexaRequestError as e:
+        # keyed by type, the messages may quote parts of the body
+        stats.error(type(e).__name__, location, str(e))
+        return
+    request = alexa_request.request
+    stats.request_types[request.get("type")] += 1
+    key = register_echo_request(request)
+    try:
+        message = Message(key)
+        mapper.process(message)
+    except Exception as e:
+        stats.error(type(e).__name__, location, str(e))
+        return
+    finally:
+        release_echo_request(key)
+    intentName = (message.get("intent") or {}).get("name")
+    intent = request.get("intent") or {}
+    if request.get("type") == "IntentRequest":
+        if intent.get("name") not in mapper.intents:
+            # not part of the interaction model, mapped as is
+            stats.error("Unknown intent", location, intent.get("name"))
+    if intentName is None:
+        # SessionEndedRequests and the like have no intent
+        return
+    stats.mapped += 1
+    stats.intents[intentName] += 1
+    slots = intent.get("slots")
+    if slots:
+        countSlots(mapper, slots, stats)
+
+
+def mapBatch(batch):
+    fileName, first, lines = batch
+    stats = ReplayStats()
+    for offset, line in enumerate(lines):
+        mapLine(_mapper, line, f'{fileName}:{first + offset}', stats)
+    return stats
+
+
+def replay(fileNames, settings, processes=None, batchSize=DEFAULT_BATCH_SIZE,
+           progress=None):
+    """Maps the requests of the logs and returns the merged ReplayStats."""
+
+    stats = ReplayStats()
+    with ProcessPoolExecutor(processes, initializer=initWorker,
+                             initargs=(settings,)) as executor:
+        # two batches per worker keep them busy, more would only fill memory
+        limit = 2 * (processes or os.cpu_count() or 1)
+        pending = set()
+        for batch in readBatches(fileNames, batchSize):
+            if len(pending) >= limit:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stats.merge(future.result())
+                if progress is not None:
+                    progress(stats)
+            pending.add(executor.submit(mapBatch, batch))
+        for future in wait(pending).done:
+            stats.merge(future.result())
+    return stats
+
+
+def readArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="+",
+                        help="files of Alexa request bodies, one per line, "
+                             "may be gzipped, - for stdin")
+    parser.add_argument("-c", "--config", help="Rasa config with the "
+                        "EchoNLUMapper", default=CONFIG)
+    parser.add_argument("-m", "--model", help="Alexa interaction model, "
+                        "overrides the skill_model of the config")
+    parser.add_argument("-o", "--output", help="json file of the statistics")
+    parser.add_argument("-p", "--processes", help="worker processes",
+                        type=int, default=None)
+    parser.add_argument("-b", "--batch", help="requests per batch",
+                        type=int, default=DEFAULT_BATCH_SIZE)
+    return parser.parse_args()
+
+
+def printProgress(stats):
+    print(f'\r{stats.requests} requests', end='', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    args = readArgs()
+    start = time.perf_counter()
+    stats = replay(args.logs, readMapperConfig(args.config, args.model),
+                   args.processes, args.batch, printProgress)
+    seconds = time.perf_counter() - start
+    result = stats.as_dict()
+    result["seconds"] = seconds
+    print(file=sys.stderr)
+    if args.output is not None:
+        with open(args.output, 'w') as writer:
+            json.dump(result, writer, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    print(f'{stats.requests} requests, {stats.mapped} mapped, '
+          f'{sum(stats.errors.values())} errors in {seconds:.1f} s '
+          f'({stats.requests / seconds if seconds else 0:.0f} requests/s)',
+          file=sys.stderr)
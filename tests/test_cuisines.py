@@ -0,0 +1,43 @@
+# run test with
+# python -m unittest tests.test_cuisines
+
+import unittest
+from actions.cuisines import CuisineCatalog, edit_distance
+
+
+class TestCuisineCatalog(unittest.TestCase):
+
+    def get_catalog(self):
+        return CuisineCatalog([("chinese", []), ("mexican", ["tex mex"]),
+                               ("greek", []), ("french", [])])
+
+    def test_exact_match(self):
+        catalog = self.get_catalog()
+        self.assertEqual("chinese", catalog.match("Chinese"))
+        self.assertEqual("mexican", catalog.match("tex  mex"))
+
+    def test_fuzzy_match(self):
+        catalog = self.get_catalog()
+        self.assertEqual("chinese", catalog.match("chinease"))
+        self.assertEqual("mexican", catalog.match("mexicans"))
+        self.assertIsNone(catalog.match("thai"))
+
+    def test_memo(self):
+        catalog = self.get_catalog()
+        catalog.match("chinease")
+        catalog.match("chinease")
+        self.assertEqual(1, catalog.match.cache_info().hits)
+        catalog.add("thai")
+        self.assertEqual("thai", catalog.match("thai"))
+
+    def test_loaded_catalog(self):
+        catalog = CuisineCatalog.load()
+        self.assertIn("italian", catalog.values)
+
+    def test_edit_distance(self):
+        self.assertEqual(1, edit_distance("greec", "greek", 2))
+        self.assertEqual(3, edit_distance("indonesian", "indian", 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
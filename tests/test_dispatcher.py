@@ -0,0 +1,73 @@
+# run test with
+# python -m unittest tests.test_dispatcher
+
+import asyncio
+import unittest
+from echo2rasa.dispatcher import EchoDispatcher, HashRing
+
+
+class TestHashRing(unittest.TestCase):
+
+    def get_users(self):
+        return ["amzn1.ask.account.user{}".format(idx) for idx in range(2000)]
+
+    def test_affinity(self):
+        ring = HashRing(["worker1", "worker2", "worker3"])
+        self.assertEqual(ring.node_for("user1"), ring.node_for("user1"))
+        self.assertEqual(3, len(ring.nodes_for("user1")))
+
+    def test_balance(self):
+        ring = HashRing(["worker1", "worker2", "worker3", "worker4"])
+        counts = {}
+        for user in self.get_users():
+            node = ring.node_for(user)
+            counts[node] = counts.get(node, 0) + 1
+        for count in counts.values():
+            self.assertGreater(count, 2000 / 4 * 0.7)
+
+    def test_rebalance(self):
+        ring = HashRing(["worker1", "worker2", "worker3", "worker4"])
+        before = {user: ring.node_for(user) for user in self.get_users()}
+        ring.remove("worker2")
+        for user, node in before.items():
+            if node != "worker2":
+                self.assertEqual(node, ring.node_for(user))
+        ring.add("worker2")
+        self.assertEqual(before, {user: ring.node_for(user)
+                                  for user in self.get_users()})
+
+    def test_empty_ring(self):
+        self.assertIsNone(HashRing().node_for("user1"))
+
+
+class TestEchoDispatcher(unittest.TestCase):
+
+    def check(self, dispatcher, *healthy):
+        async def is_healthy(worker):
+            return worker in healthy
+
+        dispatcher.is_healthy = is_healthy
+        asyncio.get_event_loop().run_until_complete(
+            dispatcher.check_workers())
+
+    def test_failed_checks(self):
+        dispatcher = EchoDispatcher(["worker1", "worker2"],
+                                    health_failures=2)
+        self.check(dispatcher, "worker1", "worker2")
+        self.assertEqual(2, len(dispatcher.ring))
+        # a single late health check keeps the worker in the ring
+        self.check(dispatcher, "worker1")
+        self.assertIn("worker2", dispatcher.ring)
+        self.check(dispatcher, "worker1", "worker2")
+        self.check(dispatcher, "worker1")
+        self.assertIn("worker2", dispatcher.ring)
+        self.check(dispatcher, "worker1")
+        self.assertNotIn("worker2", dispatcher.ring)
+        self.assertEqual(2, dispatcher.status()["workers"]["worker2"][
+            "failed_checks"])
+        self.check(dispatcher, "worker1", "worker2")
+        self.assertIn("worker2", dispatcher.ring)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,735 @@
-# not possible that way
+# run test with
+# python -m unittest tests.test_echoconnector
 
+import asyncio
+import base64
+import json
+import ntpath
+import os
+import tempfile
+import time
 import unittest
-from echo2rasa.echoconnector import te
+from unittest import mock
+from rasa.core.domain import Domain
+from rasa.core.events import Form, SlotSet
+from rasa.core.interpreter import RegexInterpreter
+from rasa.core.tracker_store import InMemoryTrackerStore
+from rasa.nlu.training_data import Message
+import echo2rasa.echoconnector as echoconnector
 
 
 class TestEchoConnector(unittest.TestCase):
 
     def test_connector_name(self):
-        # connector = EchoConnector(None)
-        self.assertEqual(connector.name, "echo")
+        self.assertEqual(echoconnector.EchoConnector.name(), "echo")
+
+
+class TestEchoMetrics(unittest.TestCase):
+
+    def test_histogram_buckets(self):
+        histogram = echoconnector.Histogram()
+        histogram.observe(0.003)
+        histogram.observe(0.3)
+        histogram.observe(30.0)
+        buckets = histogram.as_dict()["buckets"]
+        self.assertEqual(0, buckets["0.001"])
+        self.assertEqual(1, buckets["0.005"])
+        self.assertEqual(2, buckets["8.0"])
+        self.assertEqual(3, buckets["+Inf"])
+
+    def test_stage_timer(self):
+        metrics = echoconnector.EchoMetrics()
+        with metrics.time("decode"):
+            pass
+        metrics.inc("requests")
+        result = metrics.as_dict()
+        self.assertEqual(1, result["histograms"]["decode"]["count"])
+        self.assertEqual(1, result["counters"]["requests"])
+
+
+class TestAlexaRequestDecoding(unittest.TestCase):
+
+    def get_body(self):
+        with open(os.path.join("tests", "resources", "echorequest.json"),
+                  'rb') as f:
+            return f.read()
+
+    def test_decode(self):
+        req = echoconnector.decode_alexa_request(self.get_body())
+        self.assertTrue(req.sender_id.startswith("amzn1.ask.account."))
+        self.assertEqual("IntentRequest", req.request_type)
+        self.assertEqual("greet", req.request["intent"]["name"])
+
+    def test_oversized_body(self):
+        with self.assertRaises(echoconnector.AlexaRequestError) as ctx:
+            echoconnector.decode_alexa_request(self.get_body(), 1024)
+        self.assertEqual(413, ctx.exception.status)
+
+    def test_missing_request(self):
+        with self.assertRaises(echoconnector.AlexaRequestError):
+            echoconnector.decode_alexa_request(b'{"session": {}}')
+
+
+class TestAlexaResponseRenderer(unittest.TestCase):
+
+    def render(self, renderer, messages, **kwargs):
+        return json.loads(renderer.render(messages, **kwargs))
+
+    def test_speech(self):
+        renderer = echoconnector.AlexaResponseRenderer()
+        result = self.render(renderer, [{"text": "fish & chips"}])
+        speech = result["response"]["outputSpeech"]
+        self.assertEqual("SSML", speech["type"])
+        self.assertEqual("<speak>fish &amp; chips</speak>", speech["ssml"])
+        self.assertEqual(speech, result["response"]["reprompt"]["outputSpeech"])
+        self.assertEqual({"status": "test"}, result["sessionAttributes"])
+
+    def test_envelope_per_combination(self):
+        renderer = echoconnector.AlexaResponseRenderer()
+        self.render(renderer, [{"text": "hello"}])
+        result = self.render(renderer, [{"text": "bye"}],
+                             should_end_session=True)
+        self.assertTrue(result["response"]["shouldEndSession"])
+        self.assertEqual(2, len(renderer._envelopes))
+
+    def test_acknowledgement(self):
+        renderer = echoconnector.AlexaResponseRenderer()
+        result = json.loads(renderer.render_acknowledgement())
+        self.assertEqual({}, result["response"])
+
+    def test_session_attributes(self):
+        renderer = echoconnector.AlexaResponseRenderer()
+        result = self.render(renderer, [{"text": "hello"}],
+                             session_attributes={"rasa_state": "abc"})
+        self.assertEqual({"status": "test", "rasa_state": "abc"},
+                         result["sessionAttributes"])
+        self.assertEqual("<speak>hello</speak>",
+                         result["response"]["outputSpeech"]["ssml"])
+
+    def test_compiled_templates(self):
+        renderer = echoconnector.AlexaResponseRenderer()
+        renderer.compile_templates(
+            os.path.join("tests", "resources", "domain.yml"))
+        self.assertIn("what cuisine?", renderer._ssml)
+
+
+class TestTurnController(unittest.TestCase):
+
+    def run_turns(self, controller, senders):
+        order = []
+
+        async def turn(sender_id, idx):
+            async with controller.turn(sender_id):
+                order.append(("start", idx))
+                await asyncio.sleep(0.01)
+                order.append(("end", idx))
+
+        async def run():
+            return await asyncio.gather(
+                *[turn(sender_id, idx) for idx, sender_id in
+                  enumerate(senders)], return_exceptions=True)
+
+        results = asyncio.get_event_loop().run_until_complete(run())
+        return order, results
+
+    def test_sender_serialization(self):
+        controller = echoconnector.TurnController(4, 4)
+        order, _ = self.run_turns(controller, ["user1", "user1"])
+        self.assertEqual(
+            [("start", 0), ("end", 0), ("start", 1), ("end", 1)], order)
+        self.assertEqual({}, controller._locks)
+
+    def test_load_shedding(self):
+        controller = echoconnector.TurnController(1, 1)
+        _, results = self.run_turns(controller, ["user1", "user2", "user3"])
+        self.assertIsInstance(results[2], echoconnector.TurnLimitExceeded)
+        self.assertEqual(0, controller.waiting)
+
+
+class TestRemainingBudget(unittest.TestCase):
+
+    # 2019-06-21T06:19:05Z
+    SENT = 1561097945.0
+
+    def test_transit_time(self):
+        self.assertAlmostEqual(5.0, echoconnector.remaining_budget(
+            "2019-06-21T06:19:05Z", 7.0, self.SENT + 2.0))
+
+    def test_clock_skew(self):
+        self.assertEqual(7.0, echoconnector.remaining_budget(
+            "2019-06-21T06:19:05Z", 7.0, self.SENT - 2.0))
+
+    def test_clock_ahead(self):
+        # the server clock runs a few seconds ahead of the one of Alexa
+        self.assertEqual(7.0, echoconnector.remaining_budget(
+            "2019-06-21T06:19:05Z", 7.0, self.SENT + 5.0))
+        self.assertEqual(7.0, echoconnector.remaining_budget(
+            "2019-06-21T06:19:05Z", 7.0, self.SENT + 60.0))
+
+    def test_missing_timestamp(self):
+        self.assertEqual(7.0, echoconnector.remaining_budget(None, 7.0))
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = echoconnector.ResponseCache(2, 60.0)
+        cache.put("request1", b"1", now=0.0)
+        cache.put("request2", b"2", now=0.0)
+        cache.get("request1", now=1.0)
+        cache.put("request3", b"3", now=1.0)
+        self.assertEqual(b"1", cache.get("request1", now=2.0))
+        self.assertIsNone(cache.get("request2", now=2.0))
+        self.assertEqual(2, len(cache))
+
+    def test_expiry(self):
+        cache = echoconnector.ResponseCache(2, 60.0)
+        cache.put("request1", b"1", now=0.0)
+        self.assertIsNone(cache.get("request1", now=61.0))
+        self.assertEqual({"hits": 0, "misses": 1, "entries": 0},
+                         cache.as_dict())
+
+
+class WebhookRequest(object):
+    # The parts of a sanic request used by the webhook route.
+
+    def __init__(self, body):
+        self.body = body
+        self.args = {}
+        self.app = None
+        self.headers = {}
+
+
+class TestWebhook(unittest.TestCase):
+    # Alexa requests through the webhook route, with a stub on_new_message
+    # answering "hello" after the delay of its sender, unless silent.
+
+    def setUp(self):
+        echoconnector.metrics.reset()
+        self.delays = {}
+        self.silent = set()
+        self.turns = []
+
+    async def on_new_message(self, message):
+        self.turns.append(message.sender_id)
+        await asyncio.sleep(self.delays.get(message.sender_id, 0.0))
+        if message.sender_id not in self.silent:
+            await message.output_channel.send_text_message(
+                message.sender_id, "hello")
+
+    def get_receive(self, connector):
+        blueprint = connector.blueprint(self.on_new_message)
+        return next(route.handler for route in blueprint.routes
+                    if route.uri == "/webhook")
+
+    def post(self, receive, user="user1", request_id="request1",
+             request_type="IntentRequest"):
+        return receive(WebhookRequest(json.dumps({
+            "version": "1.0",
+            "session": {"new": False, "user": {"userId": user}},
+            "request": {"type": request_type, "requestId": request_id,
+                        "intent": {"name": "greet"}}}).encode("utf-8")))
+
+    def run_turns(self, *coroutines):
+        async def run():
+            # started one after the other, in the order given
+            tasks = []
+            for coroutine in coroutines:
+                tasks.append(asyncio.ensure_future(coroutine))
+                await asyncio.sleep(0.01)
+            return await asyncio.gather(*tasks)
+
+        return asyncio.get_event_loop().run_until_complete(run())
+
+    def counters(self):
+        return echoconnector.metrics.as_dict()["counters"]
+
+    def test_shed_turn_is_retryable(self):
+        connector = echoconnector.EchoConnector(max_concurrent_turns=1,
+                                                max_waiting_turns=0)
+        receive = self.get_receive(connector)
+        self.delays["user1"] = 0.1
+        _, shed = self.run_turns(self.post(receive),
+                                 self.post(receive, "user2", "request2"))
+        self.assertEqual(connector.busy_response, shed.body)
+        self.assertEqual(1, self.counters()["shed"])
+        retry, = self.run_turns(self.post(receive, "user2", "request2"))
+        self.assertEqual("<speak>hello</speak>", json.loads(retry.body)[
+            "response"]["outputSpeech"]["ssml"])
+        self.assertEqual(["user1", "user2"], self.turns)
+
+    def test_retry_waits_for_turn(self):
+        connector = echoconnector.EchoConnector()
+        receive = self.get_receive(connector)
+        self.delays["user1"] = 0.1
+        first, retry = self.run_turns(self.post(receive),
+                                      self.post(receive))
+        self.assertEqual("<speak>hello</speak>", json.loads(first.body)[
+            "response"]["outputSpeech"]["ssml"])
+        self.assertEqual(first.body, retry.body)
+        self.assertEqual(["user1"], self.turns)
+
+    def test_cached_response(self):
+        connector = echoconnector.EchoConnector()
+        receive = self.get_receive(connector)
+        first, = self.run_turns(self.post(receive))
+        replayed, = self.run_turns(self.post(receive))
+        self.assertEqual(first.body, replayed.body)
+        self.assertEqual(["user1"], self.turns)
+
+    def test_acknowledged_requests(self):
+        connector = echoconnector.EchoConnector()
+        receive = self.get_receive(connector)
+        ended, unknown = self.run_turns(
+            self.post(receive, "user1", "request1", "SessionEndedRequest"),
+            self.post(receive, "user1", "request2",
+                      "AudioPlayer.PlaybackStarted"))
+        self.assertEqual(connector.acknowledgement, ended.body)
+        self.assertEqual(connector.acknowledgement, unknown.body)
+        self.assertEqual(2, self.counters()["acknowledged"])
+        self.assertEqual([], self.turns)
+
+    def test_fallback_stages(self):
+        connector = echoconnector.EchoConnector(turn_deadline=0.1)
+        receive = self.get_receive(connector)
+        self.delays["user1"] = 0.2
+        self.silent.add("user2")
+        core, queue, empty = self.run_turns(
+            self.post(receive, "user1", "request1"),
+            self.post(receive, "user1", "request2"),
+            self.post(receive, "user2", "request3"))
+        # the turns running out of time complete in the background
+        self.run_turns(asyncio.sleep(0.4))
+        self.assertEqual(connector.timeout_response, core.body)
+        self.assertEqual(connector.timeout_response, queue.body)
+        self.assertEqual(connector.timeout_response, empty.body)
+        counters = self.counters()
+        self.assertEqual(3, counters["fallback"])
+        self.assertEqual(1, counters["fallback_core"])
+        self.assertEqual(1, counters["fallback_queue"])
+        self.assertEqual(1, counters["fallback_empty"])
+
+
+class StreamingResponse(object):
+    # The write method of a sanic streaming response.
+
+    def __init__(self, disconnect_after=None):
+        self.lines = []
+        self.disconnect_after = disconnect_after
+
+    async def write(self, data):
+        if len(self.lines) == self.disconnect_after:
+            raise ConnectionResetError("client disconnected")
+        await asyncio.sleep(0.001)
+        self.lines.append(data)
+
+
+class TestStreamResponse(unittest.TestCase):
+
+    def stream(self, connector, on_new_message, resp):
+        alexa_request = echoconnector.AlexaRequest(
+            "user1", {"type": "IntentRequest", "requestId": "request1",
+                      "intent": {"name": "greet"}}, {}, {})
+        stream = connector.stream_response(on_new_message, alexa_request)
+        asyncio.get_event_loop().run_until_complete(stream(resp))
+
+    def test_stream(self):
+        connector = echoconnector.EchoConnector(stream_queue_size=1)
+
+        async def on_new_message(message):
+            self.assertEqual("echo", message.input_channel)
+            for idx in range(3):
+                await message.output_channel.send_text_message(
+                    message.sender_id, "message {}".format(idx))
+
+        echoconnector.metrics.reset()
+        resp = StreamingResponse()
+        self.stream(connector, on_new_message, resp)
+        self.assertEqual(["<speak>message {}</speak>".format(idx)
+                          for idx in range(3)],
+                         [json.loads(line)["response"]["outputSpeech"]["ssml"]
+                          for line in resp.lines])
+        self.assertEqual(1, echoconnector.metrics.as_dict()[
+            "histograms"]["ttfb"]["count"])
+
+    def test_empty_turn(self):
+        connector = echoconnector.EchoConnector()
+
+        async def on_new_message(message):
+            pass
+
+        resp = StreamingResponse()
+        self.stream(connector, on_new_message, resp)
+        self.assertEqual([connector.timeout_response + b"\n"], resp.lines)
+
+    def test_disconnect(self):
+        connector = echoconnector.EchoConnector(stream_queue_size=1)
+        cancelled = []
+
+        async def on_new_message(message):
+            try:
+                for idx in range(10):
+                    await message.output_channel.send_text_message(
+                        message.sender_id, "message {}".format(idx))
+            except asyncio.CancelledError:
+                cancelled.append(message.sender_id)
+                raise
+
+        with self.assertRaises(ConnectionResetError):
+            self.stream(connector, on_new_message,
+                        StreamingResponse(disconnect_after=1))
+        self.assertEqual(["user1"], cancelled)
+        self.assertEqual({}, connector.turns._locks)
+
+
+def make_certificate(subject, issuer=None, issuer_key=None, san=None):
+    # Returns a certificate valid for a day and its private key.
+    from datetime import datetime, timedelta
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(65537, 2048, default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)])
+    builder = x509.CertificateBuilder().subject_name(name).issuer_name(
+        issuer.subject if issuer is not None else name).public_key(
+        key.public_key()).serial_number(x509.random_serial_number()).\
+        not_valid_before(datetime.utcnow() - timedelta(hours=1)).\
+        not_valid_after(datetime.utcnow() + timedelta(days=1))
+    if san is not None:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(san)]), critical=False)
+    certificate = builder.sign(issuer_key or key, hashes.SHA256(),
+                               default_backend())
+    return certificate, key
+
+
+@unittest.skipIf(echoconnector.x509 is None, "needs cryptography")
+class TestRequestVerification(unittest.TestCase):
+
+    URL = "https://s3.amazonaws.com/echo.api/echo-api-cert.pem"
+
+    @classmethod
+    def setUpClass(cls):
+        from cryptography.hazmat.primitives import serialization
+        root, root_key = make_certificate("Test Root")
+        leaf, cls.key = make_certificate("echo-api.amazon.com", root,
+                                         root_key, "echo-api.amazon.com")
+        pem = serialization.Encoding.PEM
+        cls.chain = leaf.public_bytes(pem) + root.public_bytes(pem)
+        cls.ca_file = tempfile.NamedTemporaryFile(suffix=".pem",
+                                                  delete=False)
+        cls.ca_file.write(root.public_bytes(pem))
+        cls.ca_file.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.ca_file.name)
+
+    def setUp(self):
+        self.verifier = echoconnector.AlexaRequestVerifier(self.ca_file.name)
+        self.fetched = []
+
+        async def fetch(url):
+            self.fetched.append(url)
+            return self.chain
+
+        self.verifier.fetch = fetch
+
+    def sign(self, body):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+        return base64.b64encode(self.key.sign(
+            body, padding.PKCS1v15(), hashes.SHA256())).decode("ascii")
+
+    def verify(self, body, signature, timestamp=None):
+        headers = {"SignatureCertChainUrl": self.URL,
+                   "Signature-256": signature}
+        alexa_request = echoconnector.AlexaRequest(
+            None, {"timestamp": timestamp or time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime())}, {}, {})
+        return asyncio.get_event_loop().run_until_complete(
+            self.verifier.verify(headers, body, alexa_request))
+
+    def test_cached_certificate(self):
+        body = b'{"request": {}}'
+        self.verify(body, self.sign(body))
+        self.verify(body, self.sign(body))
+        self.assertEqual([self.URL], self.fetched)
+        self.assertEqual(1, self.verifier.certificates.as_dict()["hits"])
+
+    def test_invalid_signature(self):
+        with self.assertRaises(echoconnector.AlexaRequestError):
+            self.verify(b'{"request": {}}', self.sign(b"other"))
+
+    def test_outdated_timestamp(self):
+        body = b'{"request": {}}'
+        with self.assertRaises(echoconnector.AlexaRequestError):
+            self.verify(body, self.sign(body), "2019-06-21T06:19:05Z")
+        self.assertEqual([], self.fetched)
+
+    def test_certificate_url(self):
+        echoconnector.validate_certificate_url(
+            "https://s3.amazonaws.com:443/echo.api/echo-api-cert.pem")
+        echoconnector.validate_certificate_url(
+            "https://s3.amazonaws.com/echo.api/../echo.api/echo-api-cert.pem")
+        for url in ("http://s3.amazonaws.com/echo.api/echo-api-cert.pem",
+                    "https://notamazon.com/echo.api/echo-api-cert.pem",
+                    "https://s3.amazonaws.com/EcHo.aPi/echo-api-cert.pem",
+                    "https://s3.amazonaws.com/echo.api/../invalid.pem",
+                    "https://s3.amazonaws.com:563/echo.api/cert.pem",
+                    "https://s3.amazonaws.com:abc/echo.api/cert.pem",
+                    "https://s3.amazonaws.com:99999/echo.api/cert.pem"):
+            with self.assertRaises(echoconnector.AlexaRequestError):
+                echoconnector.validate_certificate_url(url)
+
+    def test_certificate_url_on_windows(self):
+        # urls are no file paths, the check must not depend on os.path
+        with mock.patch.object(echoconnector.os, "path", ntpath):
+            echoconnector.validate_certificate_url(self.URL)
+            with self.assertRaises(echoconnector.AlexaRequestError):
+                echoconnector.validate_certificate_url(
+                    "https://s3.amazonaws.com/echo.api/../invalid.pem")
+
+    def test_close(self):
+        async def run():
+            await self.verifier.close()
+            self.verifier._session = echoconnector.aiohttp.ClientSession()
+            session = self.verifier._session
+            await self.verifier.close()
+            return session
+
+        session = asyncio.get_event_loop().run_until_complete(run())
+        self.assertTrue(session.closed)
+        self.assertIsNone(self.verifier._session)
+
+
+class TestSenderIdentities(unittest.TestCase):
+
+    USER = "amzn1.ask.account." + "A" * 200
+
+    def test_compact_sender_id(self):
+        identities = echoconnector.SenderIdentities("secret")
+        sender_id, new = identities.identify(self.USER)
+        self.assertTrue(new)
+        self.assertEqual(16, len(sender_id))
+        self.assertEqual((sender_id, False), identities.identify(self.USER))
+        self.assertEqual(
+            sender_id, echoconnector.SenderIdentities("secret").sender_id(
+                self.USER))
+        self.assertNotEqual(
+            sender_id, echoconnector.SenderIdentities("other").sender_id(
+                self.USER))
+        self.assertEqual(self.USER, identities.user_id(sender_id))
+
+    def test_bounded_mapping(self):
+        identities = echoconnector.SenderIdentities(max_entries=2)
+        sender_ids = [identities.identify(self.USER + str(idx))[0]
+                      for idx in range(3)]
+        self.assertEqual(2, len(identities))
+        self.assertIsNone(identities.user_id(sender_ids[0]))
+        self.assertEqual(self.USER + "2", identities.user_id(sender_ids[2]))
+
+    def test_migration(self):
+        domain = Domain.load(os.path.join("tests", "resources", "domain.yml"))
+        store = InMemoryTrackerStore(domain)
+        tracker = store.get_or_create_tracker(self.USER)
+        tracker.update(SlotSet("cuisine", "greek"))
+        store.save(tracker)
+        identities = echoconnector.SenderIdentities("secret")
+        self.assertEqual(
+            1, echoconnector.migrate_tracker_store(store, identities))
+        self.assertEqual(
+            0, echoconnector.migrate_tracker_store(store, identities))
+        migrated = store.retrieve(identities.sender_id(self.USER))
+        self.assertEqual("greek", migrated.get_slot("cuisine"))
+
+    def test_migration_not_streamed(self):
+        domain = Domain.load(os.path.join("tests", "resources", "domain.yml"))
+        broker = mock.Mock()
+        store = InMemoryTrackerStore(domain, event_broker=broker)
+        tracker = store.get_or_create_tracker(self.USER)
+        tracker.update(SlotSet("cuisine", "greek"))
+        store.save(tracker)
+        broker.reset_mock()
+        identities = echoconnector.SenderIdentities("secret")
+        self.assertTrue(echoconnector.migrate_tracker(
+            echoconnector.SnapshotTrackerStore(store), self.USER,
+            identities.sender_id(self.USER)))
+        broker.publish.assert_not_called()
+        self.assertIs(broker, store.event_broker)
+        self.assertEqual("greek", store.retrieve(identities.sender_id(
+            self.USER)).get_slot("cuisine"))
+
+
+class TestStatelessMode(unittest.TestCase):
+
+    def get_store(self):
+        domain = Domain.load(os.path.join("tests", "resources", "domain.yml"))
+        return echoconnector.SnapshotTrackerStore(InMemoryTrackerStore(domain))
+
+    def test_snapshot_roundtrip(self):
+        codec = echoconnector.DialogueStateCodec("secret")
+        store = self.get_store()
+        store.restore("user1")
+        tracker = store.retrieve("user1")
+        tracker.update(Form("restaurant_form"))
+        tracker.update(SlotSet("cuisine", "greek"))
+        store.save(tracker)
+        token = codec.encode(store.release("user1"))
+        self.assertIsNone(store.store.retrieve("user1"))
+
+        store.restore("user1", codec.decode(token))
+        tracker = store.retrieve("user1")
+        self.assertEqual("greek", tracker.get_slot("cuisine"))
+        self.assertEqual("restaurant_form", tracker.active_form["name"])
+
+    def test_tampered_snapshot(self):
+        codec = echoconnector.DialogueStateCodec("secret")
+        store = self.get_store()
+        store.restore("user1")
+        token = codec.encode(store.release("user1"))
+        self.assertIsNone(
+            echoconnector.DialogueStateCodec("other").decode(token))
+        self.assertIsNone(codec.decode(token[:-2]))
+
+    def test_oversized_snapshot(self):
+        codec = echoconnector.DialogueStateCodec("secret", max_size=16)
+        store = self.get_store()
+        store.restore("user1")
+        tracker = store.release("user1", write_through=True)
+        self.assertIsNone(codec.encode(tracker))
+        self.assertIsNotNone(store.store.retrieve("user1"))
+
+
+class TestEchoNLUMapper(unittest.TestCase):
+
+    def get_intent_request(self, slots=None):
+        intent = {"name": "inform", "confirmationStatus": "NONE"}
+        if slots is not None:
+            intent["slots"] = slots
+        return {
+            "type": "IntentRequest",
+            "requestId": "amzn1.echo-api.request.test",
+            "timestamp": "2019-06-21T06:19:05Z",
+            "locale": "en-GB",
+            "intent": intent
+        }
+
+    def process(self, text):
+        message = Message(text)
+        echoconnector.EchoNLUMapper().process(message)
+        return message
+
+    def test_registered_request(self):
+        req = self.get_intent_request({
+            "feedback": {"name": "feedback", "value": "it's fine"}})
+        key = echoconnector.register_echo_request(req)
+        try:
+            message = self.process(key)
+        finally:
+            echoconnector.release_echo_request(key)
+        self.assertEqual("inform", message.get("intent")["name"])
+        self.assertEqual("it's fine", message.get("entities")[0]["value"])
+
+    def test_json_text(self):
+        req = self.get_intent_request()
+        message = self.process(json.dumps(req))
+        self.assertEqual("inform", message.get("intent")["name"])
+
+    def test_plain_text(self):
+        for text in ["hello there", "42", ""]:
+            self.assertIsNone(echoconnector.lookup_echo_request(text))
+            self.assertIsNone(self.process(text).get("intent"))
+
+    def test_interpreter(self):
+        interpreter = echoconnector.EchoInterpreter(RegexInterpreter())
+        req = self.get_intent_request({
+            "cuisine": {"name": "cuisine", "value": "greek"}})
+        key = echoconnector.register_echo_request(req)
+        try:
+            result = asyncio.get_event_loop().run_until_complete(
+                interpreter.parse(key, key))
+        finally:
+            echoconnector.release_echo_request(key)
+        self.assertEqual("inform", result["intent"]["name"])
+        self.assertEqual("greek", result["entities"][0]["value"])
+
+    def test_launch_intent(self):
+        launch = {"type": "LaunchRequest"}
+        self.assertEqual("greet", echoconnector.EchoNLUMapper().map_request(
+            launch)[0])
+        mapper = echoconnector.EchoNLUMapper({"launch_intent": "welcome"})
+        self.assertEqual("welcome", mapper.map_request(launch)[0])
+        self.assertEqual("hello", mapper.map_request(launch, "hello")[0])
+
+    def test_interpreter_other_channels(self):
+        interpreter = echoconnector.EchoInterpreter(RegexInterpreter())
+        result = asyncio.get_event_loop().run_until_complete(
+            interpreter.parse("/greet"))
+        self.assertEqual("greet", result["intent"]["name"])
+
+    def get_indexed_mapper(self):
+        index = echoconnector.EchoNLUMapper.build_index(
+            os.path.join("echo2rasa", "tools", "echoSkillConfiguration.json"))
+        return echoconnector.EchoNLUMapper(index=index)
+
+    def test_synonym_resolution(self):
+        mapper = self.get_indexed_mapper()
+        entities = mapper.extractEntities({
+            "cuisine": {"name": "cuisine", "value": "Pan Asian"},
+            "seating": {"name": "seating"}})
+        self.assertEqual(1, len(entities))
+        self.assertEqual("asian", entities[0]["value"])
+
+    def test_alexa_resolution(self):
+        mapper = self.get_indexed_mapper()
+        entities = mapper.extractEntities({
+            "cuisine": {"name": "cuisine", "value": "gastro pubs",
+                        "resolutions": {"resolutionsPerAuthority": [{
+                            "status": {"code": "ER_SUCCESS_MATCH"},
+                            "values": [{"value": {"name": "gastropub"}}]
+                        }]}}})
+        self.assertEqual("gastropub", entities[0]["value"])
+
+    def test_empty_alexa_resolution(self):
+        mapper = self.get_indexed_mapper()
+        entities = mapper.extractEntities({
+            "cuisine": {"name": "cuisine", "value": "Pan Asian",
+                        "resolutions": {"resolutionsPerAuthority": [{
+                            "status": {"code": "ER_SUCCESS_MATCH"},
+                            "values": []
+                        }]}}})
+        self.assertEqual("asian", entities[0]["value"])
+
+    def test_persisted_index(self):
+        mapper = echoconnector.EchoNLUMapper({"slot_mapping": {
+            "seating": "seating_area"}})
+        mapper._set_index(self.get_indexed_mapper().index)
+        with tempfile.TemporaryDirectory() as tmp:
+            meta = dict(mapper.component_config)
+            meta.update(mapper.persist("echo_nlu_mapper", tmp))
+            loaded = echoconnector.EchoNLUMapper.load(meta, tmp)
+        entities = loaded.extractEntities({
+            "cuisine": {"name": "cuisine", "value": "Pan Asian"},
+            "seating": {"name": "seating", "value": "outside"}})
+        self.assertEqual(("cuisine", "asian"),
+                         (entities[0]["entity"], entities[0]["value"]))
+        self.assertEqual("seating_area", entities[1]["entity"])
+
+    def test_builtin_intent_mapping(self):
+        mapper = self.get_indexed_mapper()
+        intentName, _ = mapper.map_request({
+            "type": "IntentRequest",
+            "intent": {"name": "AMAZON.StopIntent"}})
+        self.assertEqual("stop", intentName)
+
+    def test_release(self):
+        key = echoconnector.register_echo_request(self.get_intent_request())
+        echoconnector.release_echo_request(key)
+        self.assertNotIn(key, echoconnector._echo_requests)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,22 @@
 # run test with
 # python -m tests\test_echomodel.py
 
+import argparse
 import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
 import unittest
+from unittest import mock
+import yaml
 import echo2rasa.tools.echomodel as echomodel
 
+# genEchoDefinition is a script importing echomodel from its own directory
+sys.path.insert(0, os.path.dirname(echomodel.__file__))
+genEchoDefinition = importlib.import_module("genEchoDefinition")
+
 
 class TestEchoModel(unittest.TestCase):
 
@@ -95,6 +107,264 @@ class TestEchoModel(unittest.TestCase):
         print(gastropub_type)
         self.assertIn("gastro pub", gastropub_type["name"]["synonyms"])
 
+    def test_parse_utterance(self):
+        slots, utterance = echomodel.parse_utterance(
+            "a table for [4](num_people:4), [pan asian](cuisine:asian)!")
+        self.assertEqual(["{num_people}", "{cuisine}"], slots)
+        self.assertEqual("a table for {num_people} {cuisine}", utterance)
+
+    def test_sections_after_blank_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            nluFile = os.path.join(tmp, "nlu.md")
+            with open(nluFile, 'w') as writer:
+                writer.write("## intent:greet\n- hello\n\n\n"
+                             "## synonym:asian\n- pan asian\n\n"
+                             "## intent:inform\n- [greek](cuisine) food\n")
+            model = echomodel.EchoModel(
+                "test", ".\\tests\\resources\\domain.yml", nluFile,
+                ".\\tests\\resources\\echo_domain.yml")
+            model._import_domain()
+            model._import_nlu_file()
+        self.assertEqual(["hello"], model._intent_dir["greet"]["samples"])
+        self.assertEqual(["{cuisine} food"],
+                         model._intent_dir["inform"]["samples"])
+        self.assertEqual({"greek": set()}, model._entity_values["cuisine"])
+
+    def test_incremental_export(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = echomodel.ExportCache(os.path.join(tmp, "cache.json"))
+            outFile = os.path.join(tmp, "model.json")
+            args = ("test", ".\\tests\\resources\\domain.yml",
+                    ".\\tests\\resources\\nlu.md",
+                    ".\\tests\\resources\\echo_domain.yml")
+            self.assertTrue(echomodel.EchoModel(*args, cache).export2echo(
+                outFile))
+            with open(outFile, 'r') as reader:
+                exported = reader.read()
+            self.assertFalse(echomodel.EchoModel(*args, cache).export2echo(
+                outFile))
+
+            # all sections are taken from the persisted cache
+            cache = echomodel.ExportCache(os.path.join(tmp, "cache.json"))
+            os.remove(outFile)
+            model = echomodel.EchoModel(*args, cache)
+            model.export2echo(outFile)
+            with open(outFile, 'r') as reader:
+                self.assertEqual(exported, reader.read())
+
+    def test_outdated_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cacheFile = os.path.join(tmp, "cache.json")
+            # sections parsed before lookup and synonym entries were kept
+            with open(cacheFile, 'w') as writer:
+                json.dump({"files": {"nlu": "abc"}, "parsed": {},
+                           "sections": {"abc": {"samples": [], "slots": [],
+                                                "annotations": []}}},
+                          writer)
+            cache = echomodel.ExportCache(cacheFile)
+        self.assertEqual({}, cache.files)
+        self.assertEqual({}, cache.sections)
+
+    def test_spooled_samples(self):
+        args = ("test", ".\\tests\\resources\\domain.yml",
+                ".\\tests\\resources\\nlu.md",
+                ".\\tests\\resources\\echo_domain.yml")
+        with tempfile.TemporaryDirectory() as tmp:
+            echomodel.EchoModel(*args).export2echo(
+                os.path.join(tmp, "memory.json"))
+            model = echomodel.EchoModel(*args)
+            model._max_samples = 2
+            model.export2echo(os.path.join(tmp, "spooled.json"))
+            self.assertIsNone(model._spool_dir)
+            with open(os.path.join(tmp, "memory.json"), 'r') as reader:
+                expected = reader.read()
+            with open(os.path.join(tmp, "spooled.json"), 'r') as reader:
+                self.assertEqual(expected, reader.read())
+
+    @unittest.skipIf(os.name == 'nt', "no file modes on Windows")
+    def test_exported_file_mode(self):
+        umask = os.umask(0o022)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                outFile = os.path.join(tmp, "model.json")
+                echomodel.EchoModel(
+                    "test", ".\\tests\\resources\\domain.yml",
+                    ".\\tests\\resources\\nlu.md",
+                    ".\\tests\\resources\\echo_domain.yml").export2echo(
+                    outFile)
+                self.assertEqual(0o644, os.stat(outFile).st_mode & 0o777)
+        finally:
+            os.umask(umask)
+
+    def test_unique_samples(self):
+        samples = ["a table for  {num_people}", "A table for {num_people}",
+                   " ", "a table please"]
+        self.assertEqual(["a table for {num_people}", "a table please"],
+                         list(echomodel.unique_samples(samples)))
+
+    def test_export_without_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            outFile = os.path.join(tmp, "model.json")
+            model = echomodel.EchoModel(
+                "test", ".\\tests\\resources\\domain.yml",
+                ".\\tests\\resources\\nlu.md",
+                ".\\tests\\resources\\echo_domain.yml")
+            model.export2echo(outFile)
+            self.assertEqual(["model.json"], os.listdir(tmp))
+            with open(outFile, 'r') as reader:
+                exported = json.load(reader)
+        for intent in exported["interactionModel"]["languageModel"][
+                "intents"]:
+            self.assertEqual(len(set(intent["samples"])),
+                             len(intent["samples"]))
+
+    def test_lookup_values(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            lookupFile = os.path.join(tmp, "cuisines.txt")
+            with open(lookupFile, 'w') as writer:
+                writer.write("# cuisines\nthai\tsiamese\n\ngreek\n")
+            nluFile = os.path.join(tmp, "nlu.md")
+            with open(nluFile, 'w') as writer:
+                writer.write("## intent:inform\n- [greek](cuisine) food\n\n"
+                             "## lookup:cuisine\ncuisines.txt\n- korean\n\n"
+                             "## synonym:greek\n- hellenic\n\n"
+                             "## lookup:unknown\n- value\n")
+            model = echomodel.EchoModel(
+                "test", ".\\tests\\resources\\domain.yml", nluFile,
+                ".\\tests\\resources\\echo_domain.yml")
+            model._import_domain()
+            model._import_nlu_file()
+            model._add_echo_conf()
+            model._import_entity_definitions()
+        self.assertEqual({"greek": {"hellenic"}, "korean": set(),
+                          "thai": {"siamese"}},
+                         model._entitiy_types["cuisine"])
+
+    def test_lookup_file_of_working_directory(self):
+        domain = os.path.abspath(".\\tests\\resources\\domain.yml")
+        echoconf = os.path.abspath(".\\tests\\resources\\echo_domain.yml")
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "data", "lookup"))
+            with open(os.path.join(tmp, "data", "lookup", "cuisines.txt"),
+                      'w') as writer:
+                writer.write("thai\n")
+            nluFile = os.path.join(tmp, "data", "nlu.md")
+            with open(nluFile, 'w') as writer:
+                writer.write("## lookup:cuisine\ndata/lookup/cuisines.txt\n")
+            os.chdir(tmp)
+            try:
+                model = echomodel.EchoModel("test", domain, nluFile,
+                                            echoconf)
+                model._import_nlu_file()
+                self.assertEqual([("cuisine", "data/lookup/cuisines.txt")],
+                                 model._lookup_files)
+                with open(nluFile, 'a') as writer:
+                    writer.write("missing.txt\n")
+                with self.assertRaisesRegex(FileNotFoundError,
+                                            "## lookup:cuisine"):
+                    echomodel.EchoModel("test", domain, nluFile,
+                                        echoconf)._import_nlu_file()
+            finally:
+                os.chdir(cwd)
+
+    def test_lookup_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            lookupFile = os.path.join(tmp, "cuisines.txt")
+            with open(lookupFile, 'w') as writer:
+                writer.write("thai\n")
+            cache = echomodel.ExportCache(os.path.join(tmp, "cache.json"))
+            outFile = os.path.join(tmp, "model.json")
+            args = ("test", ".\\tests\\resources\\domain.yml",
+                    ".\\tests\\resources\\nlu.md",
+                    ".\\tests\\resources\\echo_domain.yml", cache,
+                    [("cuisine", lookupFile)])
+            self.assertTrue(echomodel.EchoModel(*args).export2echo(outFile))
+            self.assertFalse(echomodel.EchoModel(*args).export2echo(outFile))
+            with open(lookupFile, 'a') as writer:
+                writer.write("korean\n")
+            self.assertTrue(echomodel.EchoModel(*args).export2echo(outFile))
+
+
+
+class TestGenEchoDefinition(unittest.TestCase):
+
+    def test_watch_after_failed_export(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            echoconf = os.path.join(tmp, "echo_domain.yml")
+            with open(echoconf, 'w') as writer:
+                writer.write("slots:\n  cuisine: [")
+            args = argparse.Namespace(
+                invocation="test", domain=".\\tests\\resources\\domain.yml",
+                nlu=".\\tests\\resources\\nlu.md", echoconf=echoconf,
+                lookup=[], output=os.path.join(tmp, "model.json"),
+                interval=0)
+            polls = []
+
+            def sleep(seconds):
+                polls.append(seconds)
+                if len(polls) == 1:
+                    # the half saved file is saved completely
+                    shutil.copy(".\\tests\\resources\\echo_domain.yml",
+                                echoconf)
+                elif len(polls) == 3:
+                    raise KeyboardInterrupt()
+
+            with mock.patch.object(genEchoDefinition.time, "sleep", sleep):
+                genEchoDefinition.watch(args, genEchoDefinition.ExportCache())
+            self.assertTrue(os.path.exists(args.output))
+
+    def write_manifest(self, tmp, jobs):
+        # the resources in tmp/domain, the jobs in tmp/jobs
+        os.mkdir(os.path.join(tmp, "domain"))
+        os.mkdir(os.path.join(tmp, "jobs"))
+        for name in ("domain.yml", "echo_domain.yml", "nlu.md"):
+            shutil.copy(".\\tests\\resources\\" + name,
+                        os.path.join(tmp, "domain", name))
+        manifestFile = os.path.join(tmp, "jobs", "manifest.yml")
+        with open(manifestFile, 'w') as writer:
+            yaml.safe_dump({"defaults": {"domain": "../domain/domain.yml",
+                                    "echoconf": "../domain/echo_domain.yml",
+                                    "nlu": "../domain/nlu.md"},
+                       "jobs": jobs}, writer)
+        return manifestFile
+
+    def test_manifest_paths(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifestFile = self.write_manifest(tmp, [
+                {"invocation": "test", "output": "test.json",
+                 "lookup": {"cuisine": "cuisines.txt"}}])
+            job, = genEchoDefinition.readManifest(manifestFile)
+        self.assertEqual(os.path.join(tmp, "jobs", "test.json"),
+                         job["output"])
+        self.assertEqual(os.path.join(tmp, "jobs", "..", "domain", "nlu.md"),
+                         job["nlu"])
+        self.assertEqual([("cuisine", os.path.join(tmp, "jobs",
+                                                   "cuisines.txt"))],
+                         job["lookup"])
+
+    def test_manifest_without_invocation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifestFile = self.write_manifest(tmp, [
+                {"invocation": "test", "output": "test.json"},
+                {"output": "other.json"}])
+            with self.assertRaisesRegex(ValueError, "Job 2 .* invocation"):
+                genEchoDefinition.readManifest(manifestFile)
+
+    def test_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifestFile = self.write_manifest(tmp, [
+                {"invocation": "first", "output": "first.json"},
+                {"invocation": "second", "output": "second.json",
+                 "nlu": "missing.md"}])
+            self.assertFalse(genEchoDefinition.runBatch(manifestFile, 2))
+            with open(os.path.join(tmp, "jobs", "first.json"), 'r') as reader:
+                exported = json.load(reader)
+            self.assertFalse(os.path.exists(
+                os.path.join(tmp, "jobs", "second.json")))
+        self.assertEqual("first", exported["interactionModel"][
+            "languageModel"]["invocationName"])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+# run test with
+# python -m unittest tests.test_replay
+
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from echo2rasa.echoconnector import EchoNLUMapper
+from echo2rasa.tools.replayEchoLog import ReplayStats, countSlots, \
+    readMapperConfig, replay
+
+SKILL_MODEL = os.path.join("echo2rasa", "tools", "echoSkillConfiguration.json")
+
+
+def envelope(request):
+    return {"version": "1.0",
+            "session": {"user": {"userId": "amzn1.ask.account.user1"}},
+            "request": request}
+
+
+class TestReplayEchoLog(unittest.TestCase):
+
+    def write_log(self, fileName, requests):
+        with gzip.open(fileName, 'wt') as writer:
+            for request in requests:
+                writer.write(request if isinstance(request, str)
+                             else json.dumps(envelope(request)))
+                writer.write('\n')
+
+    def test_replay(self):
+        inform = {"type": "IntentRequest", "intent": {
+            "name": "inform", "slots": {
+                "cuisine": {"name": "cuisine", "value": "Swedish"},
+                "seating": {"name": "seating"}}}}
+        requests = [{"type": "LaunchRequest"}, inform,
+                    {"type": "IntentRequest", "intent": {"name": "unknown"}},
+                    "{no json", "",
+                    {"type": "SessionEndedRequest"}] * 3
+        with tempfile.TemporaryDirectory() as tmp:
+            log = os.path.join(tmp, "requests.ndjson.gz")
+            self.write_log(log, requests)
+            settings = readMapperConfig(
+                os.path.join("echo2rasa", "config.yml"), SKILL_MODEL)
+            result = replay([log], settings, processes=2,
+                            batchSize=4).as_dict()
+        self.assertEqual(15, result["requests"])
+        self.assertEqual(9, result["mapped"])
+        self.assertEqual({"greet": 3, "inform": 3, "unknown": 3},
+                         result["intents"])
+        self.assertEqual({"filled": 3, "synonym": 3}, result["slots"]["cuisine"])
+        self.assertEqual({"empty": 3}, result["slots"]["seating"])
+        self.assertEqual(3, result["errors"]["Unknown intent"])
+        self.assertEqual(3, result["errors"]["AlexaRequestError"])
+        self.assertIn(f'{log}:4', [location for location, _ in
+                                   result["samples"]["AlexaRequestError"]])
+        for _, message in result["samples"]["AlexaRequestError"]:
+            self.assertTrue(
+                message.startswith("Request body is no valid json"))
+
+    def test_count_slots(self):
+        mapper = EchoNLUMapper(index=EchoNLUMapper.build_index(SKILL_MODEL))
+        stats = ReplayStats()
+        matched = {"status": {"code": "ER_SUCCESS_MATCH"},
+                   "values": [{"value": {"name": "gastropub"}}]}
+        for authority in (matched, dict(matched, values=[])):
+            countSlots(mapper, {"cuisine": {
+                "name": "cuisine", "value": "pubs", "resolutions": {
+                    "resolutionsPerAuthority": [authority]}}}, stats)
+        # a match without values is not resolved by the mapper either
+        self.assertEqual({"filled": 2, "resolved": 1, "unresolved": 1},
+                         dict(stats.slot("cuisine")))
+
+    def test_merge_samples(self):
+        stats = ReplayStats()
+        for idx in range(10):
+            other = ReplayStats()
+            other.error("Unknown intent", f'log:{idx}', "unknown")
+            stats.merge(other)
+        self.assertEqual(10, stats.errors["Unknown intent"])
+        self.assertEqual(5, len(stats.samples["Unknown intent"]))
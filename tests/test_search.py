@@ -0,0 +1,59 @@
+# run test with
+# python -m unittest tests.test_search
+
+import os
+import tempfile
+import unittest
+from actions.search import QueryCache, RestaurantSearch, SearchUnavailable, \
+    generate_restaurants
+
+
+class TestRestaurantSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp.name, "restaurants.db")
+        generate_restaurants(self.database, 500, ["greek", "indian"])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_search(self):
+        search = RestaurantSearch(self.database)
+        restaurants = search.search("Greek", "4", True)
+        self.assertEqual(3, len(restaurants))
+        for restaurant in restaurants:
+            self.assertEqual("greek", restaurant["cuisine"])
+            self.assertGreaterEqual(restaurant["capacity"], 4)
+            self.assertTrue(restaurant["outdoor"])
+        ratings = [restaurant["rating"] for restaurant in restaurants]
+        self.assertEqual(sorted(ratings, reverse=True), ratings)
+
+    def test_cached_search(self):
+        search = RestaurantSearch(self.database)
+        restaurants = search.search("indian", 2)
+        self.assertIs(restaurants, search.search("indian", "2", "maybe"))
+
+    def test_no_match(self):
+        search = RestaurantSearch(self.database)
+        self.assertEqual([], search.search("thai", 2))
+
+    def test_missing_database(self):
+        with self.assertRaises(SearchUnavailable):
+            RestaurantSearch(os.path.join(self.tmp.name, "missing.db"))
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_expiry_and_eviction(self):
+        cache = QueryCache(2, 60.0)
+        cache.put(("greek", 2, None), [], now=0.0)
+        cache.put(("greek", 4, None), [], now=0.0)
+        cache.put(("greek", 6, None), [], now=0.0)
+        self.assertIsNone(cache.get(("greek", 2, None), now=1.0))
+        self.assertEqual([], cache.get(("greek", 4, None), now=1.0))
+        self.assertIsNone(cache.get(("greek", 4, None), now=61.0))
+
+
+if __name__ == '__main__':
+    unittest.main()